@@ -1,11 +1,17 @@
 import asyncio
 import logging
+import random
 import re
+import time
+from collections import deque
+from contextlib import aclosing
 
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_gigachat.chat_models import GigaChat
 
 from config import settings
+from helpers import LOCAL_CHECK_CATEGORIES, check_answer_locally, compare_answers
+from task_generators import LOCAL_GENERATORS, generate_task_locally
 
 logger = logging.getLogger(__name__)
 
@@ -14,28 +20,234 @@ if not settings.GIGACHAT_API_KEY:
 
 # Инициализация клиента GigaChat
 giga = GigaChat(
-    credentials=settings.GIGACHAT_API_KEY, model="GigaChat-Max", verify_ssl_certs=False
+    credentials=settings.GIGACHAT_API_KEY,
+    model="GigaChat-Max",
+    verify_ssl_certs=False,
+    base_url=settings.GIGACHAT_BASE_URL,
+    auth_url=settings.GIGACHAT_AUTH_URL,
+    timeout=settings.GIGACHAT_TIMEOUT,
 )
 
+# Ограничение числа одновременных запросов к GigaChat; запросы идут через
+# общий пул соединений клиента GigaChat
+gigachat_limit = asyncio.Semaphore(settings.GIGACHAT_MAX_CONCURRENCY)
 
-async def invoke_gigachat_async(messages):
-    return await asyncio.to_thread(giga.invoke, messages)
 
+async def invoke_gigachat_async(messages, timeout: float = None):
+    """Асинхронный вызов GigaChat без выделения потока на запрос."""
+    async with gigachat_limit:
+        return await asyncio.wait_for(
+            giga.ainvoke(messages), timeout or settings.GIGACHAT_TIMEOUT
+        )
 
-async def generate_task_with_gigachat(
-    level: int, category: str = None, max_attempts: int = 3
-):
-    """Генерация задания с помощью GigaChat."""
-    attempts = 0
 
-    while attempts < max_attempts:
-        try:
-            category_filter = (
-                f"Категория задания: {category}" if category else "Случайная категория."
+async def close_gigachat():
+    """Закрытие HTTP-соединений с GigaChat."""
+    await giga._client.aclose()
+
+
+class CircuitOpenError(RuntimeError):
+    """GigaChat временно недоступен, запросы не отправляются."""
+
+
+class CircuitBreaker:
+    """
+    Размыкатель цепи: после серии ошибок подряд запросы к GigaChat
+    сразу отклоняются, а через reset_timeout пропускается один пробный.
+    Пробный запрос, который не завершился за probe_timeout или был отменён,
+    считается неудачным, чтобы цепь не осталась полуоткрытой навсегда.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self, failure_threshold: int, reset_timeout: float, probe_timeout: float
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def is_open(self) -> bool:
+        """GigaChat считается недоступным, пока цепь не замкнута: нужны запасные пути."""
+        return self.state != self.CLOSED
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас."""
+        now = time.monotonic()
+        if (
+            self.state == self.HALF_OPEN
+            and now - self.probe_started_at >= self.probe_timeout
+        ):
+            logger.warning("Пробный запрос к GigaChat завис, цепь снова разомкнута.")
+            self.record_failure()
+
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.probe_started_at = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_abandoned(self) -> None:
+        """
+        Запрос прерван (отменён или результат больше не нужен) и ничего
+        не сказал о доступности GigaChat. Пробный запрос считается неудачным.
+        """
+        if self.state == self.HALF_OPEN:
+            self.record_failure()
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+                logger.warning("GigaChat недоступен, цепь разомкнута.")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Скользящее окно задержек последних запросов."""
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+
+    def record(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def percentile(self, q: float):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+breaker = CircuitBreaker(
+    failure_threshold=settings.GIGACHAT_BREAKER_THRESHOLD,
+    reset_timeout=settings.GIGACHAT_BREAKER_RESET,
+    probe_timeout=settings.GIGACHAT_TIMEOUT,
+)
+latency = LatencyTracker()
+
+# Дублирующие запросы: сколько запущено и сколько из них ответили первыми
+hedge_metrics = {"launched": 0, "won": 0}
+
+
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с полным джиттером."""
+    ceiling = min(
+        settings.GIGACHAT_BACKOFF_MAX, settings.GIGACHAT_BACKOFF_BASE * 2**attempt
+    )
+    return random.uniform(0, ceiling)
+
+
+async def _timed_invoke(messages):
+    started = time.monotonic()
+    response = await invoke_gigachat_async(messages)
+    latency.record(time.monotonic() - started)
+    return response
+
+
+async def _hedged_invoke(messages):
+    """
+    Запрос с дублированием: если ответа нет дольше заданного перцентиля задержек,
+    отправляется второй такой же запрос и берётся тот, что ответит первым.
+    """
+    primary = asyncio.create_task(_timed_invoke(messages))
+    hedge = None
+    delay = None
+    if len(latency.samples) >= settings.GIGACHAT_HEDGE_MIN_SAMPLES:
+        delay = latency.percentile(settings.GIGACHAT_HEDGE_PERCENTILE)
+
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        hedge = asyncio.create_task(_timed_invoke(messages))
+        hedge_metrics["launched"] += 1
+        pending = {primary, hedge}
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
             )
-            messages = [
-                SystemMessage(
-                    content="""
+            for finished in done:
+                if finished.exception() is None:
+                    if finished is hedge:
+                        hedge_metrics["won"] += 1
+                    return finished.result()
+        # Оба запроса завершились ошибкой
+        return primary.result()
+    finally:
+        # В том числе при отмене вызывающего: запросы не должны остаться висеть
+        for call in (primary, hedge):
+            if call is not None and not call.done():
+                call.cancel()
+
+
+async def invoke_gigachat_resilient(messages, hedge: bool = True):
+    """Вызов GigaChat через размыкатель цепи, с дублированием медленных запросов."""
+    if not breaker.allow():
+        raise CircuitOpenError("GigaChat временно недоступен.")
+
+    try:
+        if hedge:
+            response = await _hedged_invoke(messages)
+        else:
+            response = await invoke_gigachat_async(messages)
+    except Exception:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.record_abandoned()
+        raise
+
+    breaker.record_success()
+    return response
+
+
+async def retry_with_backoff(call, max_attempts: int):
+    """Повтор вызова с экспоненциальной задержкой. При разомкнутой цепи не повторяет."""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return await call()
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Попытка {attempt} не удалась: {e}")
+            if attempt == max_attempts:
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+
+
+def resilience_metrics() -> dict:
+    return {
+        "breaker_state": breaker.state,
+        "breaker_opened": breaker.opened,
+        "breaker_rejected": breaker.rejected,
+        "hedges_launched": hedge_metrics["launched"],
+        "hedges_won": hedge_metrics["won"],
+        "latency_p95": latency.percentile(0.95),
+    }
+
+
+TASK_SYSTEM_PROMPT = """
                     Вы создаёте задания для бота, который помогает пользователям развивать внимание. 
                     Каждое задание должно быть уникальным для данного пользователя в рамках одной сессии. 
                     Уровень сложности задания зависит от текущего уровня пользователя. Чем выше уровень, тем сложнее задание.
@@ -50,69 +262,271 @@ async def generate_task_with_gigachat(
                     
                     Формат должен подходит под такую обработку:
                     match = re.search(
-                        r"Категория:\s*(.*?)\s+"
-                        r"Текст задания:\s*(.*?)\s+"
-                        r"Правильный ответ:\s*(.*?)\s+"
-                        r"Баллы за выполнение:\s*(\d+)",
+                        r"Категория:\\s*(.*?)\\s+"
+                        r"Текст задания:\\s*(.*?)\\s+"
+                        r"Правильный ответ:\\s*(.*?)\\s+"
+                        r"Баллы за выполнение:\\s*(\\d+)",
                         result,
                         re.DOTALL,
                     )
 
                     """
-                ),
-                HumanMessage(
-                    content=f"""
+
+TASK_PATTERN = re.compile(
+    r"Категория:\s*(.*?)\s+"
+    r"Текст задания:\s*(.*?)\s+"
+    r"Правильный ответ:\s*(.*?)\s+"
+    r"Баллы за выполнение:\s*(\d+)",
+    re.DOTALL,
+)
+
+# Начало очередного блока задания в ответе с несколькими заданиями
+TASK_BLOCK_START = re.compile(r"(?=Категория:)")
+
+
+def _task_messages(level: int, category: str = None, count: int = 1):
+    category_filter = (
+        f"Категория задания: {category}" if category else "Случайная категория."
+    )
+    if count == 1:
+        request = "Создайте задание для одной из следующих категорий:"
+    else:
+        request = (
+            f"Создайте {count} разных заданий для одной из следующих категорий. "
+            "Каждое задание оформите отдельным блоком в указанном формате, "
+            "блоки разделите пустой строкой:"
+        )
+
+    return [
+        SystemMessage(content=TASK_SYSTEM_PROMPT),
+        HumanMessage(
+            content=f"""
 Вы создаёте задание для тренировки внимания.
 
 **Уровень сложности:** {level}.
 **{category_filter}**
 
-Создайте задание для одной из следующих категорий:
+{request}
 1. Исправление ошибок: текст с 3-5 орфографическими, грамматическими или пунктуационными ошибками. Пользователь должен найти их и исправить.
 2. Поиск символов: таблица или текст, где пользователь должен найти указанный символ или последовательность символов.
 3. Найти лишний элемент: список слов, чисел или символов, где одно из них выбивается из общего ряда.
 4. Распознавание последовательностей: числовая или логическая последовательность, где пользователь должен определить следующий элемент.
 5. Тест на память: текст или таблица символов, которые пользователь должен запомнить. После этого задайте вопрос по содержимому.
 """
-                ),
-            ]
-            response = await invoke_gigachat_async(messages)
-            result = response.content.strip()
-
-            if not result:
-                logger.error("GigaChat вернул пустой результат.")
-                raise ValueError("GigaChat вернул пустой результат.")
-
-            match = re.search(
-                r"Категория:\s*(.*?)\s+"
-                r"Текст задания:\s*(.*?)\s+"
-                r"Правильный ответ:\s*(.*?)\s+"
-                r"Баллы за выполнение:\s*(\d+)",
-                result,
-                re.DOTALL,
-            )
+        ),
+    ]
+
+
+# Допустимые баллы за задание: число берётся из ответа модели как есть
+TASK_POINTS_MIN = 1
+TASK_POINTS_MAX = 100
+
 
-            if not match:
-                logger.error(f"Неверный формат ответа от GigaChat: {result}")
-                raise ValueError("Некорректный формат задания от GigaChat.")
+def _parse_task(match: re.Match):
+    category = match.group(1).strip()
+    task = match.group(2).strip()
+    correct_answer = match.group(3).strip()
+    points = min(max(int(match.group(4).strip()), TASK_POINTS_MIN), TASK_POINTS_MAX)
+    return category, task, correct_answer, points
 
-            category = match.group(1).strip()
-            task = match.group(2).strip()
-            correct_answer = match.group(3).strip()
-            points = int(match.group(4).strip())
-            return category, task, correct_answer, points
 
+def parse_tasks(result: str) -> list:
+    """
+    Разбор ответа с несколькими заданиями.
+    Некорректные блоки пропускаются, корректные сохраняются.
+    """
+    tasks = []
+    for block in TASK_BLOCK_START.split(result):
+        match = TASK_PATTERN.search(block)
+        if match:
+            tasks.append(_parse_task(match))
+        elif block.strip():
+            logger.warning(f"Пропущен некорректный блок задания: {block}")
+    return tasks
+
+
+async def generate_task_with_gigachat(
+    level: int, category: str = None, max_attempts: int = 3
+):
+    """Генерация задания с помощью GigaChat."""
+
+    async def attempt():
+        messages = _task_messages(level, category)
+        response = await invoke_gigachat_resilient(messages)
+        result = response.content.strip()
+
+        if not result:
+            logger.error("GigaChat вернул пустой результат.")
+            raise ValueError("GigaChat вернул пустой результат.")
+
+        match = TASK_PATTERN.search(result)
+
+        if not match:
+            logger.error(f"Неверный формат ответа от GigaChat: {result}")
+            raise ValueError("Некорректный формат задания от GigaChat.")
+
+        return _parse_task(match)
+
+    try:
+        return await retry_with_backoff(attempt, max_attempts)
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        raise RuntimeError(
+            f"Не удалось создать задание после {max_attempts} попыток."
+        ) from e
+
+
+async def generate_tasks_batch_with_gigachat(
+    level: int, category: str = None, count: int = 5, max_attempts: int = 3
+) -> list:
+    """
+    Генерация нескольких заданий одним запросом к GigaChat.
+    Может вернуть меньше заданий, чем запрошено, если часть блоков некорректна.
+    """
+
+    async def attempt():
+        messages = _task_messages(level, category, count)
+        # Пакетные запросы заметно дольше одиночных, поэтому не дублируются
+        response = await invoke_gigachat_resilient(messages, hedge=False)
+        result = response.content.strip()
+
+        tasks = parse_tasks(result)
+        if not tasks:
+            logger.error(f"Неверный формат ответа от GigaChat: {result}")
+            raise ValueError("Некорректный формат заданий от GigaChat.")
+
+        return tasks[:count]
+
+    try:
+        return await retry_with_backoff(attempt, max_attempts)
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        raise RuntimeError(
+            f"Не удалось создать задания после {max_attempts} попыток."
+        ) from e
+
+
+# Версия промпта генерации: входит в ключ объединения одинаковых запросов
+PROMPT_VERSION = 1
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов генерации.
+    Запросы с одним ключом (категория, уровень, версия промпта), пришедшие
+    в течение window секунд, обслуживаются одним пакетным вызовом GigaChat,
+    и каждый получает своё задание. В один вызов попадает не больше max_batch
+    запросов: больший пакет упёрся бы в лимит длины ответа и таймаут,
+    а его ошибка досталась бы всем ждущим сразу.
+    """
+
+    def __init__(self, window: float, max_batch: int):
+        self.window = window
+        self.max_batch = max_batch
+        # Группы, которые ещё принимают запросы
+        self._groups: dict[tuple, list[asyncio.Future]] = {}
+        self._runs: set[asyncio.Task] = set()
+
+        self.calls = 0
+        self.coalesced = 0
+        self.upstream = 0
+
+    async def generate(self, level: int, category: str = None):
+        key = (category, level, PROMPT_VERSION)
+        waiter = asyncio.get_running_loop().create_future()
+        self.calls += 1
+
+        group = self._groups.get(key)
+        if group is not None:
+            group.append(waiter)
+            self.coalesced += 1
+            if len(group) >= self.max_batch:
+                # Группа заполнена: следующие запросы начнут новую
+                del self._groups[key]
+        else:
+            group = [waiter]
+            self._groups[key] = group
+            task = asyncio.create_task(self._run(key, group, level, category))
+            self._runs.add(task)
+            task.add_done_callback(self._runs.discard)
+
+        return await waiter
+
+    async def _run(
+        self, key: tuple, waiters: list[asyncio.Future], level: int, category: str
+    ) -> None:
+        # Даём время присоединиться другим запросам с тем же ключом
+        await asyncio.sleep(self.window)
+        if self._groups.get(key) is waiters:
+            del self._groups[key]
+        self.upstream += 1
+
+        try:
+            if len(waiters) == 1:
+                tasks = [await generate_task_with_gigachat(level, category)]
+            else:
+                tasks = await generate_tasks_batch_with_gigachat(
+                    level, category, count=len(waiters)
+                )
         except Exception as e:
-            attempts += 1
-            logger.error(f"Попытка {attempts} не удалась: {e}")
-            await asyncio.sleep(1)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
 
-    raise RuntimeError("Не удалось создать задание после 3 попыток.")
+        # Если корректных заданий пришло меньше, чем ждущих, часть получит одинаковые
+        for i, waiter in enumerate(waiters):
+            if not waiter.done():
+                waiter.set_result(tasks[i % len(tasks)])
 
+    def metrics(self) -> dict:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "upstream": self.upstream,
+        }
 
-async def check_answer_with_gigachat(task, correct_answer, user_answer):
-    """Проверка ответа пользователя с помощью GigaChat."""
-    messages = [
+
+single_flight = SingleFlight(
+    window=settings.SINGLE_FLIGHT_WINDOW, max_batch=settings.TASK_POOL_SIZE
+)
+
+
+def is_local_category(category: str) -> bool:
+    """Генерируются ли задания категории локально (настройка TASK_GENERATION_MODES)."""
+    return (
+        category in LOCAL_GENERATORS
+        and settings.TASK_GENERATION_MODES.get(category) == "local"
+    )
+
+
+def _use_local_generator(category: str) -> bool:
+    # При разомкнутой цепи локальный генератор используется для всех категорий, где он есть
+    return is_local_category(category) or (
+        breaker.is_open and category in LOCAL_GENERATORS
+    )
+
+
+async def generate_task(level: int, category: str = None):
+    """Генерация задания: локально для алгоритмических категорий, иначе GigaChat."""
+    if _use_local_generator(category):
+        return generate_task_locally(level, category)
+    return await single_flight.generate(level=level, category=category)
+
+
+async def generate_tasks(level: int, category: str = None, count: int = 5) -> list:
+    """Пакетная генерация заданий с тем же выбором способа, что и generate_task."""
+    if _use_local_generator(category):
+        return [generate_task_locally(level, category) for _ in range(count)]
+    return await generate_tasks_batch_with_gigachat(
+        level=level, category=category, count=count
+    )
+
+
+def _check_messages(task, correct_answer, user_answer):
+    return [
         SystemMessage(content="Вы бот для проверки заданий."),
         HumanMessage(
             content=f"""
@@ -140,11 +554,114 @@ async def check_answer_with_gigachat(task, correct_answer, user_answer):
             """
         ),
     ]
-    response = await invoke_gigachat_async(messages)
+
+
+async def check_answer_with_gigachat(
+    task, correct_answer, user_answer, max_attempts: int = 2
+):
+    """Проверка ответа пользователя с помощью GigaChat."""
+    messages = _check_messages(task, correct_answer, user_answer)
+    response = await retry_with_backoff(
+        lambda: invoke_gigachat_resilient(messages), max_attempts
+    )
     feedback = response.content.strip()
     return feedback
 
 
+async def stream_gigachat_async(messages, timeout: float = None):
+    """Потоковый вызов GigaChat: отдаёт текст по мере генерации."""
+    if not breaker.allow():
+        raise CircuitOpenError("GigaChat временно недоступен.")
+
+    timeout = timeout or settings.GIGACHAT_TIMEOUT
+    received = False
+    settled = False
+    async with gigachat_limit:
+        chunks = giga.astream(messages).__aiter__()
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                except StopAsyncIteration:
+                    settled = True
+                    breaker.record_success()
+                    return
+                except Exception:
+                    settled = True
+                    breaker.record_failure()
+                    raise
+                received = True
+                if chunk.content:
+                    yield chunk.content
+        finally:
+            # Поток закрыт до конца (вызывающему хватило первой строки) или отменён
+            if not settled:
+                if received:
+                    breaker.record_success()
+                else:
+                    breaker.record_abandoned()
+            await chunks.aclose()
+
+
+async def stream_check_answer_with_gigachat(
+    task, correct_answer, user_answer, max_attempts: int = 2
+):
+    """
+    Проверка ответа пользователя с помощью GigaChat с потоковой выдачей.
+    Пока не пришло ни одной части, ошибка повторяется как в check_answer_with_gigachat;
+    после начала выдачи повтор невозможен, и ошибка передаётся вызывающему.
+    """
+    messages = _check_messages(task, correct_answer, user_answer)
+    for attempt in range(1, max_attempts + 1):
+        started = False
+        try:
+            async with aclosing(stream_gigachat_async(messages)) as stream:
+                async for chunk in stream:
+                    started = True
+                    yield chunk
+            return
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            if started or attempt == max_attempts:
+                raise
+            logger.error(f"Попытка {attempt} не удалась: {e}")
+            await asyncio.sleep(backoff_delay(attempt))
+
+
+# Сколько ответов проверено локально и сколько ушло в GigaChat
+check_metrics = {"local": 0, "llm": 0}
+
+
+async def check_answer_stream(category, task, correct_answer, user_answer):
+    """
+    Проверка ответа: сначала локальная для коротких однозначных ответов,
+    при неуверенности — с помощью GigaChat, ответ которого отдаётся частями
+    по мере генерации. Локальный вердикт и режим без стриминга отдаются одним куском.
+    Пока GigaChat недоступен, ответы в категориях с короткими ответами
+    сравниваются с правильным напрямую, а в остальных проверка невозможна:
+    CircuitOpenError передаётся вызывающему до первой части.
+    """
+    feedback = check_answer_locally(category, correct_answer, user_answer)
+    if feedback is None and breaker.is_open and category in LOCAL_CHECK_CATEGORIES:
+        feedback = compare_answers(correct_answer, user_answer)
+    if feedback is not None:
+        check_metrics["local"] += 1
+        yield feedback
+        return
+
+    check_metrics["llm"] += 1
+    if not settings.STREAM_FEEDBACK:
+        yield await check_answer_with_gigachat(task, correct_answer, user_answer)
+        return
+
+    async with aclosing(
+        stream_check_answer_with_gigachat(task, correct_answer, user_answer)
+    ) as stream:
+        async for chunk in stream:
+            yield chunk
+
+
 # # Асинхронная консольная программа
 # async def main():
 #
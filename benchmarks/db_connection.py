@@ -0,0 +1,68 @@
+"""
+Сравнение числа вызовов в секунду: новое соединение на каждый вызов
+против долгоживущего соединения DatabaseManager.
+
+Запуск из корня проекта: python -m benchmarks.db_connection
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+
+from database import DatabaseManager
+
+USERS = 1000
+CALLS = 20000
+
+
+def connect_per_call(db_file: str, user_id: int, level: int) -> None:
+    """Прежнее поведение: connect, запрос, commit, close."""
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
+    cursor.fetchone()
+    cursor.execute("UPDATE users SET level = ? WHERE user_id = ?", (level, user_id))
+    conn.commit()
+    conn.close()
+
+
+def pooled(db: DatabaseManager, user_id: int, level: int) -> None:
+    db.is_user_registered(user_id)
+    db.update_user_level(user_id, level)
+    # update_user_level только кладёт запись в буфер, пишем её в БД сразу,
+    # чтобы сравнивать одинаковую работу
+    db.flush_pending_writes()
+
+
+def measure(name: str, call) -> float:
+    started = time.perf_counter()
+    for i in range(CALLS):
+        call(i % USERS, i)
+    elapsed = time.perf_counter() - started
+    rate = CALLS / elapsed
+    print(f"{name:<20} {rate:>10.0f} вызовов/с")
+    return rate
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        db_file = os.path.join(directory, "bench.db")
+        db = DatabaseManager(db_file)
+        db.create_tables()
+        db.migrate()
+        with db.transaction():
+            for user_id in range(USERS):
+                db.register_user(user_id, "bench", "Bench", 20, "for_fun")
+
+        before = measure(
+            "connect-per-call",
+            lambda user_id, level: connect_per_call(db_file, user_id, level),
+        )
+        after = measure("pooled", lambda user_id, level: pooled(db, user_id, level))
+        print(f"Ускорение: x{after / before:.1f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Локальная замена GigaChat: выдаёт токен доступа и отвечает на
+/chat/completions (обычный и потоковый ответ) с заданной задержкой.
+
+Запуск бота против неё:
+    python -m benchmarks.gigachat_stub --serve --port 8090
+    GIGACHAT_AUTH_URL=http://127.0.0.1:8090/oauth \
+        GIGACHAT_BASE_URL=http://127.0.0.1:8090 python bot.py
+
+Нагрузочная проверка invoke_gigachat_async (сервер поднимается в том же процессе):
+    python -m benchmarks.gigachat_stub --count 2000 --delay 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from aiohttp import web
+
+REPLY = (
+    "Категория: Логика\n"
+    "Текст задания: Сколько будет 2 + 2?\n"
+    "Правильный ответ: 4\n"
+    "Баллы за выполнение: 5"
+)
+
+
+class GigaChatStub:
+    """Сервер-заглушка; считает одновременные запросы к /chat/completions."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self.requests = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/oauth", self.oauth)
+        app.router.add_post("/chat/completions", self.chat)
+        return app
+
+    async def oauth(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {"access_token": "stub", "expires_at": int((time.time() + 1800) * 1000)}
+        )
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if body.get("stream"):
+                return await self._stream(request, body["model"])
+            return web.json_response(
+                {
+                    "choices": [
+                        {
+                            "message": {"role": "assistant", "content": REPLY},
+                            "index": 0,
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "usage": {
+                        "prompt_tokens": 1,
+                        "completion_tokens": 1,
+                        "total_tokens": 2,
+                    },
+                    "object": "chat.completion",
+                }
+            )
+        finally:
+            self.active -= 1
+
+    async def _stream(self, request: web.Request, model: str) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for line in REPLY.splitlines(keepends=True):
+            chunk = {
+                "choices": [{"delta": {"content": line}, "index": 0}],
+                "created": int(time.time()),
+                "model": model,
+                "object": "chat.completion",
+            }
+            data = json.dumps(chunk, ensure_ascii=False)
+            await response.write(f"data: {data}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+async def serve(stub: GigaChatStub, port: int) -> web.AppRunner:
+    runner = web.AppRunner(stub.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def load(stub: GigaChatStub, port: int, count: int):
+    runner = await serve(stub, port)
+    os.environ["GIGACHAT_AUTH_URL"] = f"http://127.0.0.1:{port}/oauth"
+    os.environ["GIGACHAT_BASE_URL"] = f"http://127.0.0.1:{port}"
+
+    # Настройки читаются при импорте, поэтому адрес задаётся до него
+    from langchain_core.messages import HumanMessage
+
+    from AI import close_gigachat, invoke_gigachat_async
+    from config import settings
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(
+                invoke_gigachat_async([HumanMessage(content=str(i))])
+                for i in range(count)
+            )
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        await close_gigachat()
+        await runner.cleanup()
+
+    print(f"Запросов: {count} за {elapsed:.2f} с ({count / elapsed:.0f} в секунду)")
+    print(
+        f"Одновременно на сервере: до {stub.peak} "
+        f"(GIGACHAT_MAX_CONCURRENCY={settings.GIGACHAT_MAX_CONCURRENCY})"
+    )
+
+
+async def serve_forever(stub: GigaChatStub, port: int):
+    runner = await serve(stub, port)
+    print(f"Заглушка GigaChat: http://127.0.0.1:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serve", action="store_true")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--delay", type=float, default=0.2)
+    parser.add_argument("--count", type=int, default=1000)
+    args = parser.parse_args()
+
+    stub = GigaChatStub(args.delay)
+    if args.serve:
+        asyncio.run(serve_forever(stub, args.port))
+    else:
+        asyncio.run(load(stub, args.port, args.count))
+
+
+if __name__ == "__main__":
+    main()
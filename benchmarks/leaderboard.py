@@ -0,0 +1,72 @@
+"""
+Стоимость нажатия «🏅 Рейтинг»: сортировка и COUNT(*) по user_ratings
+против рейтинга в памяти (дерево Фенвика по значениям рейтинга).
+
+Запуск из корня проекта: python -m benchmarks.leaderboard
+"""
+
+import os
+import random
+import tempfile
+import time
+
+from database import DatabaseManager
+
+USERS = 1_000_000
+MAX_RATING = 5_000
+SQL_CALLS = 20
+CALLS = 10_000
+
+
+def measure(name: str, call, user_ids: list[int]) -> float:
+    started = time.perf_counter()
+    for user_id in user_ids:
+        call(user_id)
+    per_call = (time.perf_counter() - started) / len(user_ids) * 1e6
+    print(f"{name:<28} {per_call:>10.1f} мкс/запрос")
+    return per_call
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        db = DatabaseManager(os.path.join(directory, "bench.db"))
+        db.create_tables()
+        with db.transaction(), db.cursor() as cursor:
+            cursor.executemany(
+                """INSERT INTO users (user_id, username, first_name, age, target, created_at)
+                   VALUES (?, 'bench', 'Bench', 20, 'for_fun', '2025-01-01')""",
+                ((user_id,) for user_id in range(USERS)),
+            )
+            cursor.executemany(
+                "INSERT INTO user_ratings (user_id, rating) VALUES (?, ?)",
+                ((user_id, random.randint(0, MAX_RATING)) for user_id in range(USERS)),
+            )
+
+        user_ids = [random.randrange(USERS) for _ in range(CALLS)]
+
+        before = measure(
+            "SQL: топ и позиция", db.get_top_and_user_position, user_ids[:SQL_CALLS]
+        )
+
+        started = time.perf_counter()
+        db.load_leaderboard()
+        print(f"Загрузка рейтинга: {time.perf_counter() - started:.2f} с")
+
+        after = measure("Память: топ и позиция", db.get_top_and_user_position, user_ids)
+        measure("Память: соседи", db.get_leaderboard_around, user_ids)
+        measure(
+            "Память: случайная страница",
+            lambda user_id: db.get_leaderboard_page(user_id // 10),
+            user_ids,
+        )
+        measure(
+            "Начисление баллов",
+            lambda user_id: db.leaderboard.add(user_id, random.randint(1, 10)),
+            user_ids,
+        )
+        print(f"Ускорение топа и позиции: x{before / after:.0f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Стоимость проверки регистрации на одно сообщение: запрос к БД
+против индекса зарегистрированных пользователей в памяти.
+
+Запуск из корня проекта: python -m benchmarks.registered_users
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from database import AsyncDatabaseManager, DatabaseManager
+
+USERS = 1_000_000
+CHECKS = 100_000
+
+
+def measure(name: str, check, user_ids: list[int]) -> float:
+    started = time.perf_counter()
+    for user_id in user_ids:
+        check(user_id)
+    per_check = (time.perf_counter() - started) / len(user_ids) * 1e6
+    print(f"{name:<10} {per_check:>8.2f} мкс/сообщение")
+    return per_check
+
+
+def measure_async(adb: AsyncDatabaseManager, user_ids: list[int]) -> float:
+    """Так проверка выполнялась в middleware: запрос через поток БД."""
+
+    async def run():
+        started = time.perf_counter()
+        for user_id in user_ids:
+            await adb.is_user_registered(user_id)
+        return time.perf_counter() - started
+
+    per_check = asyncio.run(run()) / len(user_ids) * 1e6
+    adb.close()
+    print(f"{'SQL (adb)':<10} {per_check:>8.2f} мкс/сообщение")
+    return per_check
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        db = DatabaseManager(os.path.join(directory, "bench.db"))
+        db.create_tables()
+        with db.transaction(), db.cursor() as cursor:
+            cursor.executemany(
+                """INSERT INTO users (user_id, username, first_name, age, target, created_at)
+                   VALUES (?, 'bench', 'Bench', 20, 'for_fun', '2025-01-01')""",
+                ((user_id * 7,) for user_id in range(USERS)),
+            )
+
+        # Половина проверяемых id зарегистрирована, половина нет
+        user_ids = [random.randrange(USERS * 7) for _ in range(CHECKS)]
+
+        before = measure("SQL", db.is_user_registered, user_ids)
+        measure_async(AsyncDatabaseManager(db, max_pending=1), user_ids[:10_000])
+
+        started = time.perf_counter()
+        db.load_registered_users()
+        print(f"Загрузка индекса: {time.perf_counter() - started:.2f} с")
+        print(
+            f"Память индекса: {db.registered_users.memory_bytes() / 2**20:.1f} МиБ "
+            f"на {len(db.registered_users)} пользователей"
+        )
+
+        after = measure("Индекс", db.registered_users.__contains__, user_ids)
+        print(f"Ускорение: x{before / after:.0f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Время запуска планировщика: как раньше (задача в памяти на каждое напоминание
+и анкету, пересоздаются при каждом запуске) против хранилища задач в SQLite,
+где напоминания и анкеты рассылают по одной задаче на всех пользователей.
+
+Запуск из корня проекта: python -m benchmarks.scheduler_startup
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+
+from database import DatabaseManager, adb, db
+from scheduler import jobstore, scheduler, start_scheduler
+
+USERS = 100_000
+
+
+async def noop(*args):
+    pass
+
+
+def fill(db: DatabaseManager) -> None:
+    now = datetime.now()
+    with db.transaction(), db.cursor() as cursor:
+        cursor.executemany(
+            """INSERT INTO users
+               (user_id, username, first_name, age, target, created_at, survey_due_at)
+               VALUES (?, 'bench', 'Bench', 20, 'for_fun', ?, ?)""",
+            (
+                (
+                    user_id,
+                    (now - timedelta(days=random.randint(0, 3))).isoformat(),
+                    now.date().isoformat(),
+                )
+                for user_id in range(1, USERS + 1)
+            ),
+        )
+        cursor.executemany(
+            """INSERT INTO reminders (job_id, user_id, is_reminder_on, remind_time)
+               VALUES (?, ?, TRUE, ?)""",
+            (
+                (
+                    f"reminder_{user_id}",
+                    user_id,
+                    f"{random.randrange(24):02}:{random.randrange(60):02}",
+                )
+                for user_id in range(1, USERS + 1)
+            ),
+        )
+
+
+async def legacy_start(db: DatabaseManager) -> float:
+    """Как работал start_scheduler: задача на каждого пользователя при каждом запуске."""
+    started = time.perf_counter()
+    scheduler = AsyncIOScheduler()
+    with db.cursor() as cursor:
+        cursor.execute(
+            """SELECT job_id, user_id, remind_time FROM reminders
+               WHERE is_reminder_on = TRUE"""
+        )
+        reminders = cursor.fetchall()
+    for job_id, user_id, remind_time in reminders:
+        hours, minutes = map(int, remind_time.split(":"))
+        scheduler.add_job(
+            noop, CronTrigger(hour=hours, minute=minutes), args=[user_id], id=job_id
+        )
+    with db.cursor() as cursor:
+        cursor.execute(
+            """SELECT user_id, created_at FROM users
+               WHERE survey_sent = FALSE AND survey_due_at <= DATE('now')"""
+        )
+        surveys = cursor.fetchall()
+    for user_id, registration_date in surveys:
+        survey_date = datetime.fromisoformat(registration_date) + timedelta(days=2)
+        survey_date = survey_date.replace(hour=19, minute=40)
+        scheduler.add_job(
+            noop,
+            CronTrigger(
+                year=survey_date.year,
+                month=survey_date.month,
+                day=survey_date.day,
+                hour=survey_date.hour,
+                minute=survey_date.minute,
+            ),
+            args=[user_id],
+            id=f"survey_{user_id}",
+        )
+    scheduler.start()
+    elapsed = time.perf_counter() - started
+    scheduler.shutdown(wait=False)
+    # Даём завершиться задачам, которые наступили за время запуска
+    await asyncio.sleep(0.1)
+    return elapsed
+
+
+async def persistent_start() -> tuple[float, int]:
+    """Запуск бота (start_scheduler): число задач не зависит от числа пользователей."""
+    started = time.perf_counter()
+    await start_scheduler()
+    elapsed = time.perf_counter() - started
+
+    jobs = len(await adb.run(jobstore.get_all_jobs))
+    scheduler.pause()
+    scheduler.shutdown(wait=False)
+    # AsyncIOScheduler останавливается в следующей итерации цикла событий
+    await asyncio.sleep(0)
+    return elapsed, jobs
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        # Планировщик бота работает с общим подключением database.db
+        db.db_file = os.path.join(directory, "bench.db")
+        db.create_tables()
+        db.migrate()
+        fill(db)
+
+        print(f"Пользователей с напоминаниями и анкетами: {USERS}")
+        print(f"Раньше, каждый запуск:          {await legacy_start(db):8.2f} с")
+
+        elapsed, jobs = await persistent_start()
+        print(f"БД, первый запуск:              {elapsed:8.3f} с ({jobs} задач)")
+        elapsed, jobs = await persistent_start()
+        print(f"БД, повторный запуск:           {elapsed:8.3f} с ({jobs} задач)")
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""
+Отправка записанных обновлений Telegram на локальный вебхук (BOT_MODE=webhook).
+Обновления берутся из файла JSONL (одно обновление на строку), а без файла
+генерируются текстовые сообщения от --chats разных чатов.
+
+Запуск из корня проекта:
+    python -m benchmarks.webhook_replay --url http://127.0.0.1:8080/webhook \
+        --secret $WEBHOOK_SECRET [--file updates.jsonl] [--count 1000]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+import aiohttp
+
+from webhook import SECRET_HEADER
+
+
+def synthetic_updates(count: int, chats: int) -> list[dict]:
+    return [
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": update_id % chats + 1, "type": "private"},
+                "from": {
+                    "id": update_id % chats + 1,
+                    "is_bot": False,
+                    "first_name": "Bench",
+                },
+                "text": "ℹ️ Помощь",
+            },
+        }
+        for update_id in range(1, count + 1)
+    ]
+
+
+async def replay(url: str, secret: str, updates: list[dict], concurrency: int):
+    headers = {SECRET_HEADER: secret}
+    statuses = Counter()
+    limit = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+
+        async def post(update: dict):
+            async with limit, session.post(url, json=update) as response:
+                statuses[response.status] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(update) for update in updates))
+        elapsed = time.perf_counter() - started
+
+    print(f"Отправлено {len(updates)} обновлений за {elapsed:.2f} с")
+    print(f"Скорость приёма: {len(updates) / elapsed:.0f} обновлений/с")
+    print(f"Ответы: {dict(statuses)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", required=True)
+    parser.add_argument("--file")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as file:
+            updates = [json.loads(line) for line in file if line.strip()]
+    else:
+        updates = synthetic_updates(args.count, args.chats)
+
+    asyncio.run(replay(args.url, args.secret, updates, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,16 @@ import asyncio
 import logging
 
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 
+from AI import close_gigachat
 from config import settings
-from database import db
+from database import adb, db
 from handlers import menu, send_notification, start, tasks
-from middleware import RegistrationMiddleware
+from lease import leader_lease
+from middleware import RegistrationMiddleware, UserContextMiddleware
+from outbound import outbound
+from storage import storage
+from task_pool import prefetcher, task_pool
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,11 +20,18 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 bot = Bot(token=settings.BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=storage)
 
 db.create_tables()
+db.migrate()
+for query, plan in db.check_query_plans().items():
+    logger.warning(f"Запрос «{query}» выполняется без индекса: {plan}")
+db.load_registered_users()
+db.load_leaderboard()
 
 dp.message.middleware.register(RegistrationMiddleware())
+dp.message.middleware.register(UserContextMiddleware())
+dp.callback_query.middleware.register(UserContextMiddleware())
 
 # Routers
 dp.include_router(start.router)
@@ -32,17 +43,42 @@ dp.include_router(send_notification.router)
 
 
 async def on_startup():
-    from scheduler import start_scheduler
+    from scheduler import on_leadership_acquired, on_leadership_lost
 
-    await start_scheduler(bot)
-    logger.info("Уведомления подгружены")
+    outbound.start(bot)
+
+    # Рассылки по расписанию запускаются только в процессе-лидере
+    leader_lease.start(on_leadership_acquired, on_leadership_lost)
+
+    task_pool.start()
+    logger.info("Пул заданий прогревается")
+
+    adb.start_flusher(settings.WRITE_BEHIND_INTERVAL)
+    adb.start_leaderboard_sync(settings.LEADERBOARD_SYNC_INTERVAL)
+
+
+async def on_shutdown():
+    await leader_lease.close()
+    await prefetcher.close()
+    await task_pool.close()
+    await close_gigachat()
+    await outbound.close()
+    await storage.close()
+    await adb.aclose()
+    db.close()
 
 
 if __name__ == "__main__":
     dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
 
-    logger.info("Бот Запущен")
+    logger.info(f"Бот Запущен ({settings.BOT_MODE})")
     try:
-        dp.run_polling(bot)
+        if settings.BOT_MODE == "webhook":
+            from webhook import run_webhook
+
+            run_webhook(dp, bot)
+        else:
+            dp.run_polling(bot)
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
@@ -1,12 +1,149 @@
+import re
+
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
 
+# Допустимый секрет вебхука по документации Telegram (setWebhook, secret_token)
+WEBHOOK_SECRET_RE = re.compile(r"[A-Za-z0-9_-]{1,256}")
+
 
 class Settings(BaseSettings):
     BOT_TOKEN: str
     GIGACHAT_API_KEY: str
 
+    # Режим получения обновлений: "polling" или "webhook"
+    BOT_MODE: str = "polling"
+
+    # Вебхук: внешний адрес (если задан, устанавливается при запуске),
+    # путь и секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+    # (в режиме webhook обязателен)
+    WEBHOOK_URL: str | None = None
+    WEBHOOK_PATH: str = "/webhook"
+    WEBHOOK_SECRET: str | None = None
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8080
+    # Параллельно обрабатываемые чаты, предел очереди обновлений,
+    # ожидание места в очереди и дообработки при остановке, секунды
+    WEBHOOK_CONCURRENCY: int = 32
+    WEBHOOK_MAX_PENDING: int = 1000
+    WEBHOOK_QUEUE_TIMEOUT: float = 5.0
+    WEBHOOK_DRAIN_TIMEOUT: float = 30.0
+
+    # Подключение к GigaChat
+    GIGACHAT_BASE_URL: str | None = None
+    GIGACHAT_AUTH_URL: str | None = None
+    GIGACHAT_TIMEOUT: float = 60.0
+    GIGACHAT_MAX_CONCURRENCY: int = 50
+
+    # Устойчивость к сбоям GigaChat
+    GIGACHAT_BACKOFF_BASE: float = 0.5
+    GIGACHAT_BACKOFF_MAX: float = 8.0
+    GIGACHAT_HEDGE_PERCENTILE: float = 0.95
+    GIGACHAT_HEDGE_MIN_SAMPLES: int = 20
+    GIGACHAT_BREAKER_THRESHOLD: int = 5
+    GIGACHAT_BREAKER_RESET: float = 30.0
+
+    # Окно объединения одинаковых одновременных запросов генерации, секунды
+    SINGLE_FLIGHT_WINDOW: float = 0.05
+
+    # Максимум запросов к БД в очереди, после которого вызывающие ждут
+    DB_MAX_PENDING: int = 1000
+
+    # Отложенная запись уровня и рейтинга: интервал, секунды, и размер буфера
+    WRITE_BEHIND_INTERVAL: float = 0.5
+    WRITE_BEHIND_MAX_PENDING: int = 500
+
+    # Интервал синхронизации рейтинга в памяти с БД (изменения других процессов), секунды
+    LEADERBOARD_SYNC_INTERVAL: float = 5.0
+
+    # Хранилище FSM: размер кэша в памяти и сколько собирать изменения
+    # в одну транзакцию, секунды (0 — изменения одной итерации цикла событий)
+    FSM_CACHE_SIZE: int = 10000
+    FSM_FLUSH_INTERVAL: float = 0.0
+    # С БД работают несколько процессов бота: попадание в кэш FSM сверяется
+    # с версией записи в БД (в одном процессе проверка не нужна)
+    FSM_SHARED: bool = False
+
+    # Время жизни неактивной сессии FSM, секунды: по состоянию или группе состояний
+    FSM_SESSION_TTL: dict[str, float] = {
+        "TasksState:question": 3600.0,
+        "TasksState:expired": 604800.0,
+        "ReminderState": 3600.0,
+        "RegistrationState": 604800.0,
+    }
+    FSM_SESSION_TTL_DEFAULT: float = 86400.0
+    # Предел памяти кэша FSM, байты, и интервал очистки сессий, секунды
+    FSM_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+    FSM_SWEEP_INTERVAL: float = 300.0
+
+    # Рассылка напоминаний: размер пачки и сколько пропущенных минут досылать,
+    # если рассылку никто не вёл (бот был выключен)
+    REMINDER_BATCH_SIZE: int = 200
+    REMINDER_CATCHUP_MINUTES: int = 5
+
+    # Рассылка анкет: время рассылки в день срока (HH:MM) и размер пачки
+    SURVEY_TIME: str = "19:40"
+    SURVEY_BATCH_SIZE: int = 100
+
+    # Аренда лидера: при нескольких процессах рассылки выполняет только
+    # владелец аренды. Срок аренды и интервал её продления, секунды
+    LEADER_LEASE_TTL: float = 10.0
+    LEADER_HEARTBEAT_INTERVAL: float = 2.0
+
+    # Исходящие сообщения: общий лимит Telegram, сообщений в секунду, и запас,
+    # минимальный интервал между сообщениями в один чат, секунды,
+    # число отправителей, попыток и размер очереди
+    OUTBOUND_RATE: float = 30.0
+    OUTBOUND_BURST: int = 30
+    OUTBOUND_CHAT_INTERVAL: float = 1.0
+    OUTBOUND_SENDERS: int = 8
+    OUTBOUND_MAX_ATTEMPTS: int = 3
+    OUTBOUND_QUEUE_SIZE: int = 10000
+
+    # Кэш контекстов пользователей (UserContextMiddleware)
+    USER_CONTEXT_CACHE_SIZE: int = 10000
+    USER_CONTEXT_TTL: float = 30.0
+
+    # Пул заранее сгенерированных заданий
+    TASK_POOL_SIZE: int = 5
+    TASK_POOL_LEVEL_BAND: int = 3
+    TASK_POOL_WARM_BANDS: int = 2
+    TASK_POOL_REFILL_CONCURRENCY: int = 2
+
+    # Фильтр показанных пользователю заданий: ёмкость одного поколения
+    # и доля ложных срабатываний
+    SEEN_TASKS_CAPACITY: int = 2000
+    SEEN_TASKS_ERROR_RATE: float = 0.01
+
+    # Упреждающая генерация: сколько секунд ждать ответа пользователя
+    # и для скольких пользователей одновременно держать задания
+    PREFETCH_TTL: float = 3600.0
+    PREFETCH_MAX_USERS: int = 10000
+
+    # Потоковая выдача проверки ответа и минимальный интервал между правками сообщения
+    STREAM_FEEDBACK: bool = True
+    FEEDBACK_EDIT_INTERVAL: float = 1.0
+
+    # Способ генерации заданий по категориям: "local" или "llm"
+    TASK_GENERATION_MODES: dict[str, str] = {
+        "Поиск символов": "local",
+        "Распознавание последовательностей": "local",
+    }
+
     class Config:
         env_file = ".env"
 
+    @model_validator(mode="after")
+    def check_webhook_secret(self) -> "Settings":
+        """Без секрета вебхук принимал бы обновления от кого угодно."""
+        if self.BOT_MODE == "webhook":
+            if not self.WEBHOOK_SECRET:
+                raise ValueError("WEBHOOK_SECRET обязателен при BOT_MODE=webhook")
+            if not WEBHOOK_SECRET_RE.fullmatch(self.WEBHOOK_SECRET):
+                raise ValueError(
+                    "WEBHOOK_SECRET: от 1 до 256 символов A-Z, a-z, 0-9, _ и -"
+                )
+        return self
+
 
 settings = Settings()
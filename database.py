@@ -1,60 +1,557 @@
+import asyncio
+import bisect
+import functools
+import hashlib
+import heapq
+import logging
+import random
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
 from sqlite3 import Connection
 
+from config import settings
+from helpers import RotatingBloomFilter
+from leaderboard import Leaderboard
+
+logger = logging.getLogger(__name__)
+
 DB_FILE = "database.db"
 
+# Запас при синхронизации рейтинга, секунды: изменения, записанные другими
+# процессами с меткой чуть раньше уже прочитанных, тоже будут учтены
+LEADERBOARD_SYNC_OVERLAP = 5.0
+
+# Настройки соединения: WAL, без fsync на каждый коммит, кэш страниц и mmap
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+
+# Миграции схемы по порядку: номер версии — позиция в списке, начиная с 1.
+# Текущая версия хранится в PRAGMA user_version. Новые миграции только
+# добавляются в конец, уже выпущенные не меняются.
+MIGRATIONS: list[tuple[str, list[str]]] = [
+    (
+        "Индексы для напоминаний и рейтинга, время изменения рейтинга",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_reminders_user_id ON reminders (user_id)",
+            """CREATE INDEX IF NOT EXISTS idx_reminders_on_time
+               ON reminders (is_reminder_on, remind_time)""",
+            "CREATE INDEX IF NOT EXISTS idx_user_ratings_rating ON user_ratings (rating)",
+            # Для синхронизации рейтинга между процессами
+            """ALTER TABLE user_ratings
+               ADD COLUMN updated_at REAL NOT NULL DEFAULT 0""",
+            """CREATE INDEX IF NOT EXISTS idx_user_ratings_updated_at
+               ON user_ratings (updated_at)""",
+        ],
+    ),
+    (
+        "Дата отправки анкеты вместо вычисления от created_at",
+        [
+            "ALTER TABLE users ADD COLUMN survey_due_at TEXT",
+            "UPDATE users SET survey_due_at = DATE(created_at, '+2 days')",
+            """CREATE INDEX IF NOT EXISTS idx_users_survey_due
+               ON users (survey_sent, survey_due_at)""",
+        ],
+    ),
+    (
+        "Хранилище состояний FSM",
+        [
+            """CREATE TABLE IF NOT EXISTS fsm_storage (
+                   key TEXT PRIMARY KEY,
+                   state TEXT,
+                   data TEXT NOT NULL DEFAULT '{}',
+                   updated_at REAL NOT NULL,
+                   version INTEGER NOT NULL DEFAULT 0
+               ) WITHOUT ROWID""",
+        ],
+    ),
+    (
+        "Индекс для очистки неактивных сессий FSM",
+        [
+            """CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at
+               ON fsm_storage (updated_at)""",
+        ],
+    ),
+    (
+        "Покрывающий индекс для выборки напоминаний на минуту",
+        [
+            """CREATE INDEX IF NOT EXISTS idx_reminders_due
+               ON reminders (is_reminder_on, remind_time, user_id)""",
+            "DROP INDEX IF EXISTS idx_reminders_on_time",
+        ],
+    ),
+    (
+        "Недоставленные исходящие сообщения",
+        [
+            """CREATE TABLE IF NOT EXISTS dead_letters (
+                   id INTEGER PRIMARY KEY,
+                   chat_id INTEGER NOT NULL,
+                   kind TEXT NOT NULL,
+                   text TEXT NOT NULL,
+                   error TEXT NOT NULL,
+                   attempts INT NOT NULL,
+                   created_at TEXT NOT NULL
+               )""",
+        ],
+    ),
+    (
+        "Задачи планировщика",
+        [
+            """CREATE TABLE IF NOT EXISTS apscheduler_jobs (
+                   id TEXT PRIMARY KEY,
+                   next_run_time REAL,
+                   job_state BLOB NOT NULL
+               )""",
+            """CREATE INDEX IF NOT EXISTS idx_apscheduler_jobs_next_run_time
+               ON apscheduler_jobs (next_run_time)""",
+        ],
+    ),
+    (
+        "Анкеты рассылает одна задача вместо задачи на каждого пользователя",
+        [
+            r"DELETE FROM apscheduler_jobs WHERE id LIKE 'survey\_%' ESCAPE '\'",
+        ],
+    ),
+    (
+        "Аренда лидера для нескольких процессов бота",
+        [
+            """CREATE TABLE IF NOT EXISTS leases (
+                   name TEXT PRIMARY KEY,
+                   holder TEXT NOT NULL,
+                   token INTEGER NOT NULL,
+                   expires_at REAL NOT NULL,
+                   progress TEXT
+               ) WITHOUT ROWID""",
+        ],
+    ),
+]
+
+# Запросы, которые выполняются чаще всего. Они же проверяются
+# в HOT_QUERIES, поэтому текст у метода и у проверки общий
+USER_CONTEXT_QUERY = """
+    SELECT u.user_id, u.first_name, u.level, u.is_admin, ur.rating,
+        r.job_id, r.remind_time, r.is_reminder_on
+    FROM (SELECT ? AS user_id) q
+    LEFT JOIN users u ON u.user_id = q.user_id
+    LEFT JOIN reminders r ON r.user_id = q.user_id
+    LEFT JOIN user_ratings ur ON ur.user_id = q.user_id
+    LIMIT 1
+"""
+
+USER_REMINDER_QUERY = """
+    SELECT job_id, user_id, remind_time, is_reminder_on
+    FROM reminders
+    WHERE user_id = ?
+"""
+
+DUE_REMINDERS_QUERY = """
+    SELECT user_id FROM reminders
+    WHERE is_reminder_on = TRUE AND remind_time = ? AND user_id > ?
+    ORDER BY user_id
+    LIMIT ?
+"""
+
+DUE_SURVEYS_QUERY = """
+    SELECT survey_due_at, user_id FROM users
+    WHERE survey_sent = FALSE AND survey_due_at <= ?
+        AND (survey_due_at, user_id) > (?, ?)
+    ORDER BY survey_due_at, user_id
+    LIMIT ?
+"""
+
+TOP_RATING_QUERY = """
+    SELECT u.user_id,
+        COALESCE(u.username, u.first_name) AS display_name,
+        ur.rating
+    FROM user_ratings ur
+    JOIN users u ON ur.user_id = u.user_id
+    ORDER BY ur.rating DESC
+    LIMIT ?
+"""
+
+RATING_CHANGES_QUERY = """
+    SELECT ur.user_id, ur.rating
+    FROM user_ratings ur
+    JOIN users u ON ur.user_id = u.user_id
+    WHERE ur.updated_at > ?
+"""
+
+RATING_POSITION_QUERY = """
+    SELECT COUNT(*) + 1 AS position
+    FROM user_ratings
+    WHERE rating > ?
+"""
+
+# Частые запросы, которые обязаны идти по индексу (проверяются при запуске)
+HOT_QUERIES = {
+    "контекст пользователя": (USER_CONTEXT_QUERY, (1,)),
+    "напоминание пользователя": (USER_REMINDER_QUERY, (1,)),
+    "напоминания на минуту": (DUE_REMINDERS_QUERY, ("09:00", 0, 500)),
+    "анкеты к отправке": (DUE_SURVEYS_QUERY, ("2025-01-01", "", 0, 500)),
+    "топ рейтинга": (TOP_RATING_QUERY, (5,)),
+    "изменения рейтинга": (RATING_CHANGES_QUERY, (0.0,)),
+    "место в рейтинге": (RATING_POSITION_QUERY, (0,)),
+}
+
+
+def task_content_hash(category: str, task: str) -> str:
+    """Хэш нормализованного текста задания для устранения дублей."""
+    normalized = " ".join(f"{category}\n{task}".lower().replace("ё", "е").split())
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+class RegisteredUserIndex:
+    """
+    Множество id зарегистрированных пользователей в памяти.
+    Основная часть хранится отсортированным массивом int64 (8 байт на пользователя),
+    новые регистрации копятся в небольшом множестве и периодически вливаются в массив.
+    """
+
+    def __init__(self, merge_threshold: int = 1024):
+        self.merge_threshold = merge_threshold
+        self.loaded = False
+        self._sorted = array("q")
+        self._recent: set[int] = set()
+
+    def load(self, user_ids) -> None:
+        """Загрузка id, отсортированных по возрастанию."""
+        self._sorted = array("q", user_ids)
+        self._recent = set()
+        self.loaded = True
+
+    def add(self, user_id: int) -> None:
+        if not self.loaded:
+            return
+        self._recent.add(user_id)
+        if len(self._recent) >= self.merge_threshold:
+            self._sorted = array("q", heapq.merge(self._sorted, sorted(self._recent)))
+            self._recent = set()
+
+    def invalidate(self) -> None:
+        """Сбросить индекс; до следующей загрузки проверки идут в БД."""
+        self.loaded = False
+        self._sorted = array("q")
+        self._recent = set()
+
+    def __contains__(self, user_id: int) -> bool:
+        if user_id in self._recent:
+            return True
+        position = bisect.bisect_left(self._sorted, user_id)
+        return position < len(self._sorted) and self._sorted[position] == user_id
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._recent)
+
+    def memory_bytes(self) -> int:
+        return self._sorted.itemsize * len(self._sorted) + 64 * len(self._recent)
+
+
+@dataclass(slots=True)
+class UserContext:
+    """Данные пользователя, нужные обработчикам, загруженные одним запросом."""
+
+    user_id: int
+    registered: bool
+    first_name: str
+    level: int
+    is_admin: bool
+    rating: int
+    reminder_job_id: str | None
+    remind_time: str | None
+    is_reminder_on: bool
+
+    @property
+    def reminder(self):
+        """Напоминание в формате is_reminder_exist: (job_id, user_id, время, включено)."""
+        if self.reminder_job_id is None:
+            return None
+        return (
+            self.reminder_job_id,
+            self.user_id,
+            self.remind_time,
+            self.is_reminder_on,
+        )
+
+
+class UserContextCache:
+    """LRU-кэш контекстов пользователей с коротким временем жизни."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[int, tuple[float, UserContext]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> UserContext | None:
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None:
+                return None
+            expires_at, context = item
+            if expires_at < time.monotonic():
+                del self._items[user_id]
+                return None
+            self._items.move_to_end(user_id)
+            return context
+
+    def put(self, context: UserContext) -> None:
+        with self._lock:
+            self._items[context.user_id] = (time.monotonic() + self.ttl, context)
+            self._items.move_to_end(context.user_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id: int = None) -> None:
+        """Сбросить контекст пользователя или весь кэш, если user_id не указан."""
+        with self._lock:
+            if user_id is None:
+                self._items.clear()
+            else:
+                self._items.pop(user_id, None)
+
+
+class WriteBehindBuffer:
+    """
+    Отложенные изменения уровня и рейтинга: по каждому пользователю хранится
+    последний уровень и сумма начисленных баллов до следующей записи в БД.
+    """
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self.levels: dict[int, int] = {}
+        self.ratings: dict[int, int] = {}
+
+        self.flushes = 0
+        self.flushed = 0
+
+    def set_level(self, user_id: int, level: int) -> None:
+        self.levels[user_id] = level
+
+    def add_rating(self, user_id: int, points: int) -> None:
+        self.ratings[user_id] = self.ratings.get(user_id, 0) + points
+
+    def drain(self) -> tuple[dict[int, int], dict[int, int]]:
+        levels, ratings = self.levels, self.ratings
+        self.levels, self.ratings = {}, {}
+        return levels, ratings
+
+    def restore(self, levels: dict[int, int], ratings: dict[int, int]) -> None:
+        """Вернуть изменения после неудачной записи, не затирая более новые."""
+        for user_id, level in levels.items():
+            self.levels.setdefault(user_id, level)
+        for user_id, points in ratings.items():
+            self.add_rating(user_id, points)
+
+    @property
+    def is_full(self) -> bool:
+        return len(self) >= self.max_pending
+
+    def __len__(self) -> int:
+        return len(self.levels) + len(self.ratings)
+
 
 class DatabaseManager:
     def __init__(self, db_file: str = DB_FILE):
         self.db_file = db_file
+        self.registered_users = RegisteredUserIndex()
+        self.leaderboard = Leaderboard()
+        self.user_contexts = UserContextCache(
+            max_size=settings.USER_CONTEXT_CACHE_SIZE, ttl=settings.USER_CONTEXT_TTL
+        )
+        self.pending_writes = WriteBehindBuffer(
+            max_pending=settings.WRITE_BEHIND_MAX_PENDING
+        )
+        self._connection: Connection | None = None
+        self._lock = threading.RLock()
+        # Время (time.time()), до которого изменения рейтинга уже прочитаны
+        self._leaderboard_synced_at = 0.0
+        self._transaction_depth = 0
 
     def get_connection(self) -> Connection:
-        """Получение соединения с базой данных"""
-        return sqlite3.connect(self.db_file)
+        """Получение долгоживущего соединения с базой данных"""
+        if self._connection is None:
+            # Автокоммит: транзакции открываются явно через transaction()
+            self._connection = sqlite3.connect(
+                self.db_file,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=256,
+            )
+            for pragma in PRAGMAS:
+                self._connection.execute(pragma)
+        return self._connection
+
+    @contextmanager
+    def cursor(self):
+        """Курсор общего соединения; соединение используется одним потоком за раз"""
+        with self._lock:
+            cursor = self.get_connection().cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Явная транзакция, которая может охватывать несколько вызовов методов.
+        Вложенные transaction() выполняются в рамках внешней.
+        """
+        with self._lock:
+            connection = self.get_connection()
+            if self._transaction_depth == 0:
+                connection.execute("BEGIN IMMEDIATE")
+            self._transaction_depth += 1
+            try:
+                yield
+            except BaseException:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    connection.execute("ROLLBACK")
+                raise
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                connection.execute("COMMIT")
+
+    def close(self):
+        """Закрытие соединения с базой данных"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
 
     def create_tables(self):
         """Создание таблиц в базе данных"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        # Таблица пользователей
-        cursor.execute(
-            """CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT NOT NULL,
-                first_name TEXT NOT NULL,
-                age INT NOT NULL,
-                target TEXT NOT NULL,
-                level INT DEFAULT 1,
-                is_admin BOOLEAN DEFAULT FALSE,
-                created_at TEXT NOT NULL,
-                survey_sent BOOLEAN DEFAULT FALSE
-            );"""
-        )
-
-        # Таблица напоминаний
-        cursor.execute(
-            """CREATE TABLE IF NOT EXISTS reminders (
-                job_id TEXT PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                is_reminder_on BOOLEAN NOT NULL,
-                remind_time DATETIME NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            );"""
-        )
-
-        # Таблица Рейтинга
-        cursor.execute(
-            """CREATE TABLE IF NOT EXISTS user_ratings (
-                user_id INTEGER PRIMARY KEY,
-                rating INTEGER NOT NULL DEFAULT 0,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            );"""
-        )
-
-        conn.commit()
-        conn.close()
+        with self.cursor() as cursor:
+            # Таблица пользователей
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT NOT NULL,
+                    first_name TEXT NOT NULL,
+                    age INT NOT NULL,
+                    target TEXT NOT NULL,
+                    level INT DEFAULT 1,
+                    is_admin BOOLEAN DEFAULT FALSE,
+                    created_at TEXT NOT NULL,
+                    survey_sent BOOLEAN DEFAULT FALSE
+                );"""
+            )
+
+            # Таблица напоминаний
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS reminders (
+                    job_id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    is_reminder_on BOOLEAN NOT NULL,
+                    remind_time DATETIME NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                );"""
+            )
+
+            # Таблица Рейтинга
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS user_ratings (
+                    user_id INTEGER PRIMARY KEY,
+                    rating INTEGER NOT NULL DEFAULT 0,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                );"""
+            )
+
+            # Кэш сгенерированных заданий
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS tasks (
+                    task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    content_hash TEXT NOT NULL UNIQUE,
+                    category TEXT NOT NULL,
+                    level INT NOT NULL,
+                    task TEXT NOT NULL,
+                    correct_answer TEXT NOT NULL,
+                    points INT NOT NULL,
+                    created_at TEXT NOT NULL
+                );"""
+            )
+            cursor.execute(
+                """CREATE INDEX IF NOT EXISTS idx_tasks_category_level
+                   ON tasks (category, level);"""
+            )
+
+            # Задания, которые пользователь уже видел (два поколения фильтра Блума)
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS user_seen_tasks (
+                    user_id INTEGER PRIMARY KEY,
+                    seen BLOB NOT NULL,
+                    previous BLOB,
+                    seen_count INTEGER NOT NULL DEFAULT 0,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                );"""
+            )
+
+    def migrate(self) -> int:
+        """
+        Применение миграций, которых ещё нет в базе.
+        Каждая миграция выполняется в своей транзакции вместе с повышением версии.
+        Возвращает итоговую версию схемы.
+        """
+        with self._lock, self.cursor() as cursor:
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+
+            for number, (description, statements) in enumerate(MIGRATIONS, start=1):
+                if number <= version:
+                    continue
+                with self.transaction():
+                    for statement in statements:
+                        cursor.execute(statement)
+                    cursor.execute(f"PRAGMA user_version = {number}")
+                logger.info(f"Применена миграция {number}: {description}")
+                version = number
+
+        return version
+
+    def check_query_plans(self) -> dict[str, list[str]]:
+        """
+        EXPLAIN QUERY PLAN для частых запросов.
+        Возвращает запросы, план которых содержит полный просмотр таблицы
+        или временное B-дерево для сортировки, с соответствующими шагами плана.
+        """
+        problems = {}
+        with self.cursor() as cursor:
+            for name, (query, params) in HOT_QUERIES.items():
+                cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+                details = [row[3] for row in cursor.fetchall()]
+                # Подзапросы из одной строки просматривать полностью нормально
+                subqueries = {
+                    detail.split()[-1]
+                    for detail in details
+                    if detail.startswith(("CO-ROUTINE", "MATERIALIZE"))
+                }
+                bad = [
+                    detail
+                    for detail in details
+                    if (
+                        detail.startswith("SCAN")
+                        and "INDEX" not in detail
+                        and detail != "SCAN CONSTANT ROW"
+                        and detail.split()[1] not in subqueries
+                    )
+                    or "TEMP B-TREE" in detail
+                ]
+                if bad:
+                    problems[name] = bad
+        return problems
 
     def register_user(
         self, user_id: int, username: str, first_name: str, age: int, target: str
@@ -63,326 +560,791 @@ class DatabaseManager:
         if self.is_user_registered(user_id):
             raise ValueError(f"User {user_id} is already registered.")
 
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        created_at = datetime.now().isoformat()
-
-        cursor.execute(
-            """INSERT INTO users (user_id, username, first_name, age, target, created_at)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            (user_id, username, first_name, age, target, created_at),
+        with self.cursor() as cursor:
+            now = datetime.now()
+            created_at = now.isoformat()
+            survey_due_at = (now + timedelta(days=2)).date().isoformat()
+
+            cursor.execute(
+                """INSERT INTO users
+                   (user_id, username, first_name, age, target, created_at, survey_due_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (user_id, username, first_name, age, target, created_at, survey_due_at),
+            )
+
+        self.registered_users.add(user_id)
+        self.user_contexts.invalidate(user_id)
+
+    def load_registered_users(self) -> None:
+        """Загрузка индекса зарегистрированных пользователей в память"""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT user_id FROM users ORDER BY user_id")
+            self.registered_users.load(row[0] for row in cursor)
+
+    def get_user_context(self, user_id: int) -> UserContext:
+        """Контекст пользователя из кэша, а при промахе — одним запросом к БД"""
+        context = self.user_contexts.get(user_id)
+        if context is None:
+            context = self.load_user_context(user_id)
+        return context
+
+    def load_user_context(self, user_id: int) -> UserContext:
+        """Загрузка пользователя, его напоминания и рейтинга одним запросом"""
+        with self._lock, self.cursor() as cursor:
+            cursor.execute(USER_CONTEXT_QUERY, (user_id,))
+            row = cursor.fetchone()
+            # Ещё не записанные изменения должны быть видны сразу
+            pending_level = self.pending_writes.levels.get(user_id)
+            pending_rating = self.pending_writes.ratings.get(user_id, 0)
+
+        context = UserContext(
+            user_id=user_id,
+            registered=row[0] is not None,
+            first_name=row[1] or "",
+            level=pending_level or row[2] or 1,
+            is_admin=bool(row[3]),
+            rating=(row[4] or 0) + pending_rating,
+            reminder_job_id=row[5],
+            remind_time=row[6],
+            is_reminder_on=bool(row[7]),
         )
-
-        conn.commit()
-        conn.close()
+        self.user_contexts.put(context)
+        return context
 
     def is_user_registered(self, user_id: int) -> bool:
         """Проверка, зарегистрирован ли пользователь"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
+        with self.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
+            result = cursor.fetchone()
 
-        conn.close()
-        return result is not None
+            return result is not None
 
     def get_user_firstname(self, user_id: int) -> str:
         """Получить имя пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT first_name FROM users WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
+        with self.cursor() as cursor:
+            cursor.execute("SELECT first_name FROM users WHERE user_id = ?", (user_id,))
+            result = cursor.fetchone()
 
-        conn.close()
-        return result[0] if result else ""
+            return result[0] if result else ""
 
     def get_user_level(self, user_id: int) -> int:
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self._lock:
+            pending = self.pending_writes.levels.get(user_id)
+        if pending is not None:
+            return pending
 
-        cursor.execute("SELECT level FROM users WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
+        with self.cursor() as cursor:
+            cursor.execute("SELECT level FROM users WHERE user_id = ?", (user_id,))
+            result = cursor.fetchone()
 
-        conn.close()
-        return result[0] if result else 1
+            return result[0] if result else 1
 
     def update_user_level(self, user_id: int, level: int) -> None:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("UPDATE users SET level = ? WHERE user_id = ?", (level, user_id))
-
-        conn.commit()
-        conn.close()
+        """Изменение уровня попадает в буфер и записывается в БД пакетом"""
+        with self._lock:
+            self.pending_writes.set_level(user_id, level)
+            full = self.pending_writes.is_full
+
+        self.user_contexts.invalidate(user_id)
+        if full:
+            self.flush_pending_writes()
+
+    def flush_pending_writes(self) -> int:
+        """Запись накопленных изменений уровня и рейтинга одной транзакцией"""
+        with self._lock:
+            levels, ratings = self.pending_writes.drain()
+            if not levels and not ratings:
+                return 0
+
+            try:
+                with self.transaction(), self.cursor() as cursor:
+                    cursor.executemany(
+                        "UPDATE users SET level = ? WHERE user_id = ?",
+                        [(level, user_id) for user_id, level in levels.items()],
+                    )
+                    now = time.time()
+                    cursor.executemany(
+                        """
+                        INSERT INTO user_ratings (user_id, rating, updated_at)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET
+                            rating = rating + excluded.rating,
+                            updated_at = excluded.updated_at;
+                        """,
+                        [(user_id, points, now) for user_id, points in ratings.items()],
+                    )
+            except Exception:
+                self.pending_writes.restore(levels, ratings)
+                raise
+
+            flushed = len(levels) + len(ratings)
+            self.pending_writes.flushes += 1
+            self.pending_writes.flushed += flushed
+            return flushed
 
     # Reminders
     def check_is_reminder_on(self, user_id: int) -> bool:
         """Проверка, включены ли напоминания"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            SELECT 1
-            FROM reminders
-            WHERE user_id = ? AND is_reminder_on = TRUE
-            """,
-            (user_id,),
-        )
-        result = cursor.fetchone()
-
-        conn.close()
-        return result is not None
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT 1
+                FROM reminders
+                WHERE user_id = ? AND is_reminder_on = TRUE
+                """,
+                (user_id,),
+            )
+            result = cursor.fetchone()
+
+            return result is not None
 
     def update_reminder_status(self, user_id: int, is_reminder_on: bool):
         # Обновить статус напоминания.
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            UPDATE reminders
-            SET is_reminder_on = ?
-            WHERE user_id = ?
-            """,
-            (is_reminder_on, user_id),
-        )
-
-        conn.commit()
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE reminders
+                SET is_reminder_on = ?
+                WHERE user_id = ?
+                """,
+                (is_reminder_on, user_id),
+            )
+
+        self.user_contexts.invalidate(user_id)
 
     def add_reminder(
         self, job_id: str, user_id: int, remind_time: datetime, is_reminder_on: bool
     ):
         """Сохранить напоминание"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """INSERT INTO reminders (job_id, user_id, remind_time, is_reminder_on)
-               VALUES (?, ?, ?, ?)""",
-            (job_id, user_id, remind_time, is_reminder_on),
-        )
+        with self.cursor() as cursor:
+            cursor.execute(
+                """INSERT INTO reminders (job_id, user_id, remind_time, is_reminder_on)
+                   VALUES (?, ?, ?, ?)""",
+                (job_id, user_id, remind_time, is_reminder_on),
+            )
 
-        conn.commit()
-        conn.close()
+        self.user_contexts.invalidate(user_id)
 
     def delete_reminder(self, job_id: str):
         """Удалить напоминание"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("DELETE FROM reminders WHERE job_id = ?", (job_id,))
-
-        conn.commit()
-        conn.close()
-
-    def get_all_on_reminders(self):
-        """Получить все напоминания"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.cursor() as cursor:
+            cursor.execute("DELETE FROM reminders WHERE job_id = ?", (job_id,))
 
-        cursor.execute(
-            "SELECT job_id, user_id, remind_time FROM reminders WHERE is_reminder_on = TRUE"
-        )
-        reminders = cursor.fetchall()
+        # id пользователя по job_id не восстановить, поэтому сбрасывается весь кэш
+        self.user_contexts.invalidate()
 
-        conn.close()
-        return reminders
+    def get_due_reminders(
+        self, remind_time: str, after_user_id: int, limit: int
+    ) -> list[int]:
+        """
+        Пользователи с включённым напоминанием на время remind_time (HH:MM),
+        по возрастанию id, начиная после after_user_id.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(DUE_REMINDERS_QUERY, (remind_time, after_user_id, limit))
+            return [row[0] for row in cursor.fetchall()]
 
     def is_reminder_exist(self, user_id: int):
         """Получить напоминание, если оно существует"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            SELECT job_id, user_id, remind_time, is_reminder_on
-            FROM reminders
-            WHERE user_id = ?
-            """,
-            (user_id,),
-        )
-        reminder = cursor.fetchone()
-        conn.close()
-        return reminder
+        with self.cursor() as cursor:
+            cursor.execute(USER_REMINDER_QUERY, (user_id,))
+            reminder = cursor.fetchone()
+            return reminder
 
     def get_reminder_time(self, user_id: int):
         """Получить напоминание, если оно существует"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            SELECT remind_time
-            FROM reminders
-            WHERE user_id = ?
-            """,
-            (user_id,),
-        )
-        reminder = cursor.fetchone()
-        conn.close()
-        return reminder[0]
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT remind_time
+                FROM reminders
+                WHERE user_id = ?
+                """,
+                (user_id,),
+            )
+            reminder = cursor.fetchone()
+            return reminder[0]
 
     def update_reminder_time(self, user_id: int, remind_time: str):
         """Обновить время напоминания"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            UPDATE reminders
-            SET remind_time = ?
-            WHERE user_id = ?
-            """,
-            (remind_time, user_id),
-        )
-
-        conn.commit()
-        conn.close()
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE reminders
+                SET remind_time = ?
+                WHERE user_id = ?
+                """,
+                (remind_time, user_id),
+            )
+
+        self.user_contexts.invalidate(user_id)
 
     def is_user_admin(self, user_id: int) -> bool:
         """Проверка, является ли пользователь администратором"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.cursor() as cursor:
+            cursor.execute("SELECT is_admin FROM users WHERE user_id = ?", (user_id,))
+            result = cursor.fetchone()
 
-        cursor.execute("SELECT is_admin FROM users WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
-
-        conn.close()
-        return result[0] if result else False
+            return result[0] if result else False
 
     def update_user_rating(self, user_id: int, points: int) -> None:
-        """Обновить рейтинг пользователя"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """Обновить рейтинг пользователя (через буфер отложенной записи)"""
+        with self._lock:
+            self.pending_writes.add_rating(user_id, points)
+            self.leaderboard.add(user_id, points)
+            full = self.pending_writes.is_full
+
+        self.user_contexts.invalidate(user_id)
+        if full:
+            self.flush_pending_writes()
+
+    def load_leaderboard(self) -> None:
+        """Загрузка рейтинга пользователей в память"""
+        with self._lock, self.cursor() as cursor:
+            self._leaderboard_synced_at = time.time()
+            cursor.execute(
+                """
+                SELECT ur.user_id, ur.rating
+                FROM user_ratings ur
+                JOIN users u ON ur.user_id = u.user_id;
+                """
+            )
+            rows = cursor.fetchall()
+            # Начисления, которые ещё в буфере, в БД пока не видны
+            pending = dict(self.pending_writes.ratings)
+            self.leaderboard.load(rows)
+            for user_id, points in pending.items():
+                self.leaderboard.add(user_id, points)
+
+    def sync_leaderboard(self) -> int:
+        """
+        Подтянуть в рейтинг в памяти изменения, записанные в БД с прошлой
+        синхронизации, в том числе другими процессами бота.
+        Возвращает число обновлённых пользователей.
+        """
+        with self._lock, self.cursor() as cursor:
+            if not self.leaderboard.loaded:
+                return 0
+
+            started = time.time()
+            cursor.execute(
+                RATING_CHANGES_QUERY,
+                (self._leaderboard_synced_at - LEADERBOARD_SYNC_OVERLAP,),
+            )
+            rows = cursor.fetchall()
+            # Начисления этого процесса, которые ещё в буфере, в БД пока не видны
+            pending = self.pending_writes.ratings
+            for user_id, rating in rows:
+                self.leaderboard.set(user_id, rating + pending.get(user_id, 0))
+            self._leaderboard_synced_at = started
+            return len(rows)
+
+    def _with_display_names(self, rows: list[tuple[int, int]]) -> list[dict]:
+        """Добавить имена к парам (user_id, рейтинг)"""
+        if not rows:
+            return []
+
+        with self.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT user_id, COALESCE(username, first_name)
+                FROM users
+                WHERE user_id IN ({", ".join("?" * len(rows))});
+                """,
+                [user_id for user_id, _ in rows],
+            )
+            names = dict(cursor.fetchall())
+
+        return [
+            {"user_id": user_id, "display_name": names.get(user_id), "rating": rating}
+            for user_id, rating in rows
+        ]
+
+    def get_leaderboard_page(self, page: int, page_size: int = 10) -> dict:
+        """Страница рейтинга (с 0) и общее число пользователей в рейтинге"""
+        if not self.leaderboard.loaded:
+            self.load_leaderboard()
+
+        with self._lock:
+            rows = self.leaderboard.page(page * page_size, page_size)
+            total = len(self.leaderboard)
 
-        cursor.execute(
-            """
-            INSERT INTO user_ratings (user_id, rating)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET rating = rating + ?;
-            """,
-            (user_id, points, points),
-        )
+        return {
+            "users": self._with_display_names(rows),
+            "start": page * page_size + 1,
+            "total": total,
+        }
+
+    def get_leaderboard_around(self, user_id: int, radius: int = 2) -> dict:
+        """Соседи пользователя по рейтингу: radius сверху и снизу"""
+        if not self.leaderboard.loaded:
+            self.load_leaderboard()
 
-        conn.commit()
-        conn.close()
+        with self._lock:
+            start, rows = self.leaderboard.around(user_id, radius)
+
+        return {"users": self._with_display_names(rows), "start": start}
 
     def get_top_and_user_position(self, user_id: int, limit: int = 5) -> dict:
         """
         Получить топ пользователей и позицию конкретного пользователя.
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        # Получить топ-5 пользователей с их именами
-        cursor.execute(
-            """
-            SELECT u.user_id, 
-                COALESCE(u.username, u.first_name) AS display_name, 
-                ur.rating
-            FROM user_ratings ur
-            JOIN users u ON ur.user_id = u.user_id
-            ORDER BY ur.rating DESC
-            LIMIT ?;
-            """,
-            (limit,),
-        )
-        top_users = cursor.fetchall()
+        if self.leaderboard.loaded:
+            with self._lock:
+                top_users = self.leaderboard.page(0, limit)
+                position = self.leaderboard.rank(user_id)
+                user_rating = self.leaderboard.rating(user_id)
 
-        # Получить рейтинг текущего пользователя
-        cursor.execute(
-            """
-            SELECT ur.rating
-            FROM user_ratings ur
-            WHERE ur.user_id = ?;
-            """,
-            (user_id,),
-        )
-        user_rating = cursor.fetchone()
-
-        if user_rating is None:
-            conn.close()
             return {
-                "top_users": top_users,
-                "user_position": -1,
-                "user_rating": 0,
+                "top_users": self._with_display_names(top_users),
+                "user_position": position or -1,
+                "user_rating": user_rating or 0,
             }
 
-        # Получить позицию текущего пользователя
-        cursor.execute(
-            """
-            SELECT COUNT(*) + 1 AS position
-            FROM user_ratings
-            WHERE rating > ?;
-            """,
-            (user_rating[0],),
-        )
-        user_position = cursor.fetchone()[0]
-
-        conn.close()
+        # Рейтинг должен учитывать ещё не записанные начисления
+        self.flush_pending_writes()
+
+        with self.cursor() as cursor:
+            # Получить топ-5 пользователей с их именами
+            cursor.execute(TOP_RATING_QUERY, (limit,))
+            top_users = cursor.fetchall()
+
+            # Получить рейтинг текущего пользователя
+            cursor.execute(
+                """
+                SELECT ur.rating
+                FROM user_ratings ur
+                WHERE ur.user_id = ?;
+                """,
+                (user_id,),
+            )
+            user_rating = cursor.fetchone()
+
+            if user_rating is None:
+                return {
+                    "top_users": top_users,
+                    "user_position": -1,
+                    "user_rating": 0,
+                }
+
+            # Получить позицию текущего пользователя
+            cursor.execute(RATING_POSITION_QUERY, (user_rating[0],))
+            user_position = cursor.fetchone()[0]
 
-        return {
-            "top_users": [
-                {"user_id": user[0], "display_name": user[1], "rating": user[2]}
-                for user in top_users
-            ],
-            "user_position": user_position,
-            "user_rating": user_rating[0],
-        }
+            return {
+                "top_users": [
+                    {"user_id": user[0], "display_name": user[1], "rating": user[2]}
+                    for user in top_users
+                ],
+                "user_position": user_position,
+                "user_rating": user_rating[0],
+            }
 
     def get_user_count(self) -> int:
         """
         Получить количество пользователей в базе данных.
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT COUNT(*) FROM users;")
-        total_users = cursor.fetchone()[0]
+        with self.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM users;")
+            total_users = cursor.fetchone()[0]
 
-        conn.close()
-        return total_users
+            return total_users
 
-    def get_users_for_survey(self):
+    def get_due_surveys(
+        self, due_date: str, after: tuple[str, int], limit: int
+    ) -> list[tuple[str, int]]:
         """
-        Возвращает пользователей, которым нужно отправить напоминание об анкете.
+        Пользователи, которым пора отправить анкету (срок не позже due_date),
+        в виде (survey_due_at, user_id) по возрастанию, начиная после after.
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.cursor() as cursor:
+            cursor.execute(DUE_SURVEYS_QUERY, (due_date, *after, limit))
+            return cursor.fetchall()
 
+    def mark_surveys_sent(self, user_ids: list[int]) -> None:
+        """
+        Отмечает, что пользователям было отправлено напоминание об анкете.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE users
+                SET survey_sent = TRUE
+                WHERE user_id IN ({", ".join("?" * len(user_ids))});
+                """,
+                user_ids,
+            )
+
+    # Outbound
+    def add_dead_letter(
+        self, chat_id: int, kind: str, text: str, error: str, attempts: int
+    ) -> None:
+        """Сохранить сообщение, которое не удалось доставить"""
+        with self.cursor() as cursor:
+            cursor.execute(
+                """INSERT INTO dead_letters (chat_id, kind, text, error, attempts, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (chat_id, kind, text, error, attempts, datetime.now().isoformat()),
+            )
+
+    # Lease
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> int | None:
+        """
+        Взять или продлить аренду name на ttl секунд.
+        Возвращает токен (fencing token) или None, если аренда у другого процесса.
+        Токен увеличивается при каждой смене владельца и после истечения аренды.
+        """
+        now = time.time()
+        with self.transaction(), self.cursor() as cursor:
+            cursor.execute(
+                "SELECT holder, token, expires_at FROM leases WHERE name = ?", (name,)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                token = 1
+            elif row[0] == holder and row[2] > now:
+                token = row[1]
+            elif row[2] <= now:
+                token = row[1] + 1
+            else:
+                return None
+
+            cursor.execute(
+                """
+                INSERT INTO leases (name, holder, token, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    holder = excluded.holder,
+                    token = excluded.token,
+                    expires_at = excluded.expires_at;
+                """,
+                (name, holder, token, now + ttl),
+            )
+            return token
+
+    def check_lease(self, name: str, holder: str, token: int) -> bool:
+        """Аренда всё ещё у holder с этим токеном и не истекла"""
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT 1 FROM leases
+                WHERE name = ? AND holder = ? AND token = ? AND expires_at > ?;
+                """,
+                (name, holder, token, time.time()),
+            )
+            return cursor.fetchone() is not None
+
+    def release_lease(self, name: str, holder: str) -> None:
+        """Освободить аренду, чтобы другой процесс взял её сразу, не дожидаясь срока"""
+        with self.cursor() as cursor:
+            cursor.execute(
+                "UPDATE leases SET expires_at = 0 WHERE name = ? AND holder = ?",
+                (name, holder),
+            )
+
+    def get_lease_progress(self, name: str) -> str | None:
+        """Прогресс работы лидера (JSON), сохранённый рядом с арендой name"""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT progress FROM leases WHERE name = ?", (name,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def save_lease_progress(
+        self, name: str, holder: str, token: int, progress: str
+    ) -> bool:
+        """
+        Сохранить прогресс работы лидера (JSON) рядом с арендой name,
+        только если аренда всё ещё у holder с этим токеном и не истекла
+        """
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE leases SET progress = ?
+                WHERE name = ? AND holder = ? AND token = ? AND expires_at > ?;
+                """,
+                (progress, name, holder, token, time.time()),
+            )
+            return cursor.rowcount == 1
+
+    # FSM
+    def get_fsm_record(self, key: str):
+        """Состояние, данные FSM (JSON) и версия записи по ключу или None"""
+        with self.cursor() as cursor:
+            cursor.execute(
+                "SELECT state, data, version FROM fsm_storage WHERE key = ?", (key,)
+            )
+            return cursor.fetchone()
+
+    def get_fsm_version(self, key: str) -> int | None:
+        """Версия записи FSM или None, если записи нет"""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT version FROM fsm_storage WHERE key = ?", (key,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def save_fsm_records(
+        self, states: dict[str, str | None], data: dict[str, str]
+    ) -> dict[str, int | None]:
+        """
+        Запись накопленных состояний и данных FSM одной транзакцией.
+        Каждая изменённая запись получает новую случайную версию; возвращает
+        версии записанных ключей (None — пустая запись удалена).
+        """
+        now = time.time()
+        version = random.getrandbits(63)
+        keys = states.keys() | data.keys()
+        with self.transaction(), self.cursor() as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO fsm_storage (key, state, updated_at, version)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    state = excluded.state,
+                    updated_at = excluded.updated_at,
+                    version = excluded.version;
+                """,
+                [(key, state, now, version) for key, state in states.items()],
+            )
+            cursor.executemany(
+                """
+                INSERT INTO fsm_storage (key, data, updated_at, version)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    data = excluded.data,
+                    updated_at = excluded.updated_at,
+                    version = excluded.version;
+                """,
+                [(key, value, now, version) for key, value in data.items()],
+            )
+            # Пустые записи не храним
+            cursor.executemany(
+                "DELETE FROM fsm_storage WHERE key = ? AND state IS NULL AND data = '{}'",
+                [(key,) for key in keys],
+            )
+            return {key: self.get_fsm_version(key) for key in keys}
+
+    def get_idle_fsm_records(
+        self, cutoff: float, after: tuple[float, str], limit: int
+    ) -> list[tuple]:
+        """
+        Записи FSM, не менявшиеся с момента cutoff, по возрастанию updated_at.
+        after — (updated_at, key) последней записи предыдущей пачки.
+        """
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT key, state, data, updated_at
+                FROM fsm_storage
+                WHERE updated_at < ? AND (updated_at, key) > (?, ?)
+                ORDER BY updated_at, key
+                LIMIT ?;
+                """,
+                (cutoff, *after, limit),
+            )
+            return cursor.fetchall()
+
+    def expire_fsm_records(
+        self, replaced: list[tuple], deleted: list[tuple[str, float]]
+    ) -> None:
+        """
+        Замена истёкших сессий (state, data, key, updated_at) и удаление
+        (key, updated_at). Записи, изменённые после выборки, не трогаются.
+        Новая версия заставит другие процессы перечитать запись из БД.
+        """
+        now = time.time()
+        version = random.getrandbits(63)
+        with self.transaction(), self.cursor() as cursor:
+            cursor.executemany(
+                """
+                UPDATE fsm_storage SET state = ?, data = ?, updated_at = ?, version = ?
+                WHERE key = ? AND updated_at = ?;
+                """,
+                [
+                    (state, data, now, version, key, updated_at)
+                    for state, data, key, updated_at in replaced
+                ],
+            )
+            cursor.executemany(
+                "DELETE FROM fsm_storage WHERE key = ? AND updated_at = ?", deleted
+            )
+
+    def count_fsm_sessions(self) -> int:
+        """Количество пользователей с активным состоянием FSM"""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM fsm_storage WHERE state IS NOT NULL")
+            return cursor.fetchone()[0]
+
+    # Tasks
+    def save_task(
+        self, category: str, level: int, task: str, correct_answer: str, points: int
+    ) -> int:
+        """Сохранить задание в кэш. Возвращает id задания (нового или уже существующего)."""
+        content_hash = task_content_hash(category, task)
+        with self.cursor() as cursor:
+            cursor.execute(
+                """INSERT OR IGNORE INTO tasks
+                   (content_hash, category, level, task, correct_answer, points, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    content_hash,
+                    category,
+                    level,
+                    task,
+                    correct_answer,
+                    points,
+                    datetime.now().isoformat(),
+                ),
+            )
+            cursor.execute(
+                "SELECT task_id FROM tasks WHERE content_hash = ?", (content_hash,)
+            )
+            task_id = cursor.fetchone()[0]
+
+            return task_id
+
+    def _get_seen_tasks(self, cursor, user_id: int) -> RotatingBloomFilter:
         cursor.execute(
-            """
-            SELECT user_id, created_at
-            FROM users
-            WHERE survey_sent = FALSE
-            AND DATE(created_at, '+2 days') <= DATE('now');
-            """
+            "SELECT seen, previous, seen_count FROM user_seen_tasks WHERE user_id = ?",
+            (user_id,),
+        )
+        result = cursor.fetchone() or (None, None, 0)
+        return RotatingBloomFilter(
+            settings.SEEN_TASKS_CAPACITY, settings.SEEN_TASKS_ERROR_RATE, *result
         )
-        users = cursor.fetchall()
-        conn.close()
-        return users
 
-    def mark_survey_sent(self, user_id):
+    def claim_task(self, user_id: int, task_id: int) -> bool:
         """
-        Отмечает, что пользователю было отправлено напоминание об анкете.
+        Отметить задание как показанное пользователю.
+        Возвращает False, если пользователь его уже видел.
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
+        with self.cursor() as cursor:
+            seen = self._get_seen_tasks(cursor, user_id)
+            added = seen.add(task_id)
+            if added:
+                cursor.execute(
+                    """
+                    INSERT INTO user_seen_tasks (user_id, seen, previous, seen_count)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        seen = excluded.seen,
+                        previous = excluded.previous,
+                        seen_count = excluded.seen_count;
+                    """,
+                    (
+                        user_id,
+                        seen.current.to_bytes(),
+                        seen.previous.to_bytes() if seen.previous else None,
+                        seen.count,
+                    ),
+                )
+
+            return added
+
+    def get_unseen_task(
+        self, user_id: int, category: str, level: int, spread: int = 1, limit: int = 64
+    ):
+        """
+        Найти в кэше задание категории и близкого уровня, которое пользователь ещё не видел.
+        Возвращает (task_id, (категория, текст, ответ, баллы)) или None.
+        """
+        with self.cursor() as cursor:
+            seen = self._get_seen_tasks(cursor, user_id)
+
+            cursor.execute(
+                "SELECT MIN(task_id), MAX(task_id) FROM tasks WHERE category = ?",
+                (category,),
+            )
+            low, high = cursor.fetchone()
+            if low is None:
+                return None
+
+            # Начинаем со случайного места, чтобы разные пользователи получали разные задания
+            pivot = random.randint(low, high)
+            query = """
+                SELECT task_id, category, task, correct_answer, points
+                FROM tasks
+                WHERE category = ? AND level BETWEEN ? AND ? AND task_id {} ?
+                LIMIT ?
             """
-            UPDATE users
-            SET survey_sent = TRUE
-            WHERE user_id = ?;
-            """,
-            (user_id,),
+            params = (category, level - spread, level + spread)
+            cursor.execute(query.format(">="), (*params, pivot, limit))
+            candidates = cursor.fetchall()
+            cursor.execute(query.format("<"), (*params, pivot, limit))
+            candidates += cursor.fetchall()
+
+            for task_id, *task in candidates:
+                if task_id not in seen:
+                    return task_id, tuple(task)
+            return None
+
+
+class AsyncDatabaseManager:
+    """
+    Асинхронный доступ к DatabaseManager: запросы выполняются в отдельном
+    потоке БД, и цикл событий не блокируется на дисковом вводе-выводе.
+    Методы те же, что у DatabaseManager, но их нужно ожидать через await.
+    """
+
+    def __init__(self, db: DatabaseManager, max_pending: int):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        # Ограничение очереди: при переполнении новые запросы ждут свободного места
+        self._pending = asyncio.Semaphore(max_pending)
+
+    async def run(self, func, *args, **kwargs):
+        async with self._pending:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs)
+            )
+
+    def __getattr__(self, name: str):
+        method = getattr(self.db, name)
+        if name.startswith("_") or not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+
+        return call
+
+    def start_flusher(self, interval: float) -> None:
+        """Периодическая запись буфера отложенных изменений"""
+        self._flusher = asyncio.create_task(self._flush_periodically(interval))
+
+    async def _flush_periodically(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush_pending_writes()
+            except Exception as e:
+                logger.error(f"Ошибка записи отложенных изменений: {e}")
+
+    def start_leaderboard_sync(self, interval: float) -> None:
+        """Периодическая синхронизация рейтинга в памяти с БД"""
+        self._leaderboard_sync = asyncio.create_task(
+            self._sync_leaderboard_periodically(interval)
         )
-        conn.commit()
-        conn.close()
+
+    async def _sync_leaderboard_periodically(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sync_leaderboard()
+            except Exception as e:
+                logger.error(f"Ошибка синхронизации рейтинга: {e}")
+
+    async def aclose(self) -> None:
+        """Остановка: запись оставшихся изменений и завершение потока БД"""
+        for name in ("_flusher", "_leaderboard_sync"):
+            task = getattr(self, name, None)
+            if task is not None:
+                task.cancel()
+        await self.flush_pending_writes()
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
 
 
 db = DatabaseManager()
+adb = AsyncDatabaseManager(db, max_pending=settings.DB_MAX_PENDING)
@@ -1,12 +1,22 @@
 import logging
 
 from aiogram import F, Router
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, Message
 
-from database import db
+from AI import check_metrics, resilience_metrics, single_flight
+from database import UserContext, adb
 from helpers import format_rating_message, format_reminder_message
-from keyboards.menu import admin_menu_kb, main_menu_kb
+from keyboards.menu import (
+    admin_menu_kb,
+    get_rating_page_kb,
+    main_menu_kb,
+    rating_full_kb,
+)
 from keyboards.tasks import reminder_inline_kb, tasks_inline_kb
+from lease import leader_lease
+from outbound import outbound
+from storage import storage
+from task_pool import prefetcher, task_pool
 
 router = Router()
 
@@ -19,24 +29,22 @@ async def menu_command(message: Message):
 
 
 @router.message(F.text == "/admin")
-async def admin_command(message: Message):
-    is_admin = db.is_user_admin(message.from_user.id)
-    if not is_admin:
+async def admin_command(message: Message, user_context: UserContext):
+    if not user_context.is_admin:
         await message.answer("Вы не являетесь админом!", reply_markup=main_menu_kb)
         return
     await message.answer("Админ панель\nВыберите действие:", reply_markup=admin_menu_kb)
 
 
 @router.message(F.text == "Список всех пользователей")
-async def list_users_command(message: Message):
+async def list_users_command(message: Message, user_context: UserContext):
     """Обработчик для вывода количества пользователей"""
-    is_admin = db.is_user_admin(message.from_user.id)
-    if not is_admin:
+    if not user_context.is_admin:
         await message.answer("Вы не являетесь админом!", reply_markup=main_menu_kb)
         return
 
     try:
-        total_users = db.get_user_count()
+        total_users = await adb.get_user_count()
         await message.answer(f"Всего зарегистрированных пользователей: {total_users}")
     except Exception as e:
         logger.error(f"Ошибка при получении количества пользователей: {e}")
@@ -45,23 +53,79 @@ async def list_users_command(message: Message):
         )
 
 
+@router.message(F.text == "/stats")
+async def stats_command(message: Message, user_context: UserContext):
+    """Обработчик для вывода внутренних метрик бота"""
+    if not user_context.is_admin:
+        await message.answer("Вы не являетесь админом!", reply_markup=main_menu_kb)
+        return
+
+    pool = task_pool.metrics()
+    prefetch = prefetcher.metrics()
+    resilience = resilience_metrics()
+    coalescing = single_flight.metrics()
+    fsm = storage.metrics()
+    delivery = outbound.metrics()
+    leadership = leader_lease.metrics()
+    await message.answer(
+        "Пул заданий:\n"
+        f"Попадания: {pool['hits']}\n"
+        f"Промахи: {pool['misses']}\n"
+        f"Пополнения: {pool['refills']} (ошибок: {pool['refill_errors']})\n"
+        f"В буфере: {pool['buffered']}\n\n"
+        "Упреждающая генерация:\n"
+        f"Активных пользователей: {prefetch['users']}\n"
+        f"Использовано: {prefetch['used']}\n"
+        f"Возвращено в пул: {prefetch['recycled']} "
+        f"(не дождались ответа: {prefetch['expired']})\n\n"
+        "Проверка ответов:\n"
+        f"Локально: {check_metrics['local']}\n"
+        f"GigaChat: {check_metrics['llm']}\n\n"
+        "Доступность GigaChat:\n"
+        f"Цепь: {resilience['breaker_state']} "
+        f"(размыканий: {resilience['breaker_opened']}, "
+        f"отклонено: {resilience['breaker_rejected']})\n"
+        f"Дублирующих запросов: {resilience['hedges_launched']} "
+        f"(ответили первыми: {resilience['hedges_won']})\n"
+        f"Задержка p95: {resilience['latency_p95']}\n\n"
+        "Объединение запросов генерации:\n"
+        f"Запросов: {coalescing['calls']}\n"
+        f"Объединено: {coalescing['coalesced']}\n"
+        f"Вызовов GigaChat: {coalescing['upstream']}\n\n"
+        "Хранилище FSM:\n"
+        f"Активных сессий: {fsm['sessions']} (истекло: {fsm['expired']})\n"
+        f"В памяти: {fsm['bytes'] / 1024:.0f} КиБ, записей в кэше: {fsm['cached']} "
+        f"(вытеснено: {fsm['evicted']})\n"
+        f"Попаданий в кэш: {fsm['hits']}, промахов: {fsm['misses']} "
+        f"(устарело: {fsm['stale']})\n"
+        f"Ожидают записи: {fsm['pending']}, пакетов записано: {fsm['flushes']}\n\n"
+        "Исходящие сообщения:\n"
+        f"В очереди: {delivery['queued']}, скорость: {delivery['rate']:.1f} в секунду\n"
+        f"Доставлено: {delivery['sent']}, повторов: {delivery['retried']}, "
+        f"пауз по лимиту: {delivery['throttled']}, не доставлено: {delivery['dead']}\n\n"
+        "Рассылки по расписанию:\n"
+        f"Этот процесс лидер: {'да' if leadership['leader'] else 'нет'} "
+        f"(токен: {leadership['token']})\n"
+        f"Получено лидерство: {leadership['acquired']}, потеряно: {leadership['lost']}"
+    )
+
+
 @router.message(F.text == "📋 Задания")
 async def tasks(message: Message):
     await message.answer("Выберите задание", reply_markup=tasks_inline_kb)
 
 
 @router.message(F.text == "⏰ Напоминания")
-async def reminder(message: Message):
-    reminder = db.is_reminder_exist(message.from_user.id)
+async def reminder(message: Message, user_context: UserContext):
     await message.answer(
-        format_reminder_message(reminder), reply_markup=reminder_inline_kb
+        format_reminder_message(user_context.reminder), reply_markup=reminder_inline_kb
     )
 
 
 @router.message(F.text == "🏆 Уровень")
-async def rating(message: Message):
+async def rating(message: Message, user_context: UserContext):
     await message.answer(
-        f"Ваш Текущий Уровень 🏆: {db.get_user_level(message.from_user.id)}\n\nРешайте больше заданий, чтобы быть лучше всех!"
+        f"Ваш Текущий Уровень 🏆: {user_context.level}\n\nРешайте больше заданий, чтобы быть лучше всех!"
     )
 
 
@@ -73,7 +137,7 @@ async def help(message: Message):
 @router.message(F.text == "🏅 Рейтинг")
 async def rating(message: Message):
     try:
-        user_data = db.get_top_and_user_position(message.from_user.id)
+        user_data = await adb.get_top_and_user_position(message.from_user.id)
 
         rating_message = "Топ пользователей:\n"
         for i, user in enumerate(user_data["top_users"], start=1):
@@ -83,13 +147,51 @@ async def rating(message: Message):
             rating_message += "\nВаши результаты:\n"
             rating_message += f"Позиция: {user_data['user_position']}\n"
             rating_message += f"Очки: {user_data['user_rating']}"
+
+            # Соседи по рейтингу, если пользователь не в топе
+            if user_data["user_position"] > len(user_data["top_users"]):
+                around = await adb.get_leaderboard_around(message.from_user.id)
+                rating_message += "\n\nРядом с вами:\n"
+                for i, user in enumerate(around["users"], start=around["start"]):
+                    rating_message += (
+                        f"{i}. {user['display_name']}: {user['rating']} очков\n"
+                    )
         else:
             rating_message += "Вы пока не в рейтинге.\n"
 
-        await message.answer(rating_message)
+        await message.answer(rating_message, reply_markup=rating_full_kb)
 
     except Exception as e:
         await message.answer(
             "Произошла ошибка при получении рейтинга. Попробуйте позже."
         )
         logger.error(f"Ошибка при получении рейтинга пользователя: {e}")
+
+
+RATING_PAGE_SIZE = 10
+
+
+@router.callback_query(F.data.startswith("rating_page_"))
+async def rating_page(callback: CallbackQuery):
+    """Постраничный просмотр всего рейтинга."""
+    page = int(callback.data.removeprefix("rating_page_"))
+    try:
+        data = await adb.get_leaderboard_page(page, RATING_PAGE_SIZE)
+    except Exception as e:
+        logger.error(f"Ошибка при получении страницы рейтинга {page}: {e}")
+        await callback.answer("Не удалось загрузить рейтинг. Попробуйте позже.")
+        return
+
+    if not data["users"]:
+        await callback.answer("Здесь пока никого нет.")
+        return
+
+    text = f"Рейтинг (всего участников: {data['total']}):\n"
+    for i, user in enumerate(data["users"], start=data["start"]):
+        text += f"{i}. {user['display_name']}: {user['rating']} очков\n"
+
+    has_next = data["start"] + len(data["users"]) <= data["total"]
+    await callback.message.edit_text(
+        text, reply_markup=get_rating_page_kb(page, has_next)
+    )
+    await callback.answer()
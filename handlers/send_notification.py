@@ -2,38 +2,31 @@ from aiogram import F, Router
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
 
-from database import db
+from database import UserContext, adb
 from keyboards.tasks import reminder_inline_kb
-from scheduler import scheduler, send_reminder
+from scheduler import scheduler
 from states.reminder import ReminderState
 
 router = Router()
 
 
 @router.callback_query(F.data == "reminder_on")
-async def start_notifications(callback: CallbackQuery, state: FSMContext):
+async def start_notifications(
+    callback: CallbackQuery, state: FSMContext, user_context: UserContext
+):
     user_id = callback.from_user.id
 
-    reminder = db.is_reminder_exist(user_id)
+    reminder = user_context.reminder
 
     if reminder:
         if reminder[3]:
             await callback.message.answer("Уведомления уже были запущены!")
         else:
-            db.update_reminder_status(user_id=user_id, is_reminder_on=True)
+            # Рассылкой занимается ReminderDispatcher — достаточно включить в БД
+            await adb.update_reminder_status(user_id=user_id, is_reminder_on=True)
 
             remind_time = reminder[2]
-            hours, minutes = map(int, remind_time.split(":"))
-
-            scheduler.add_job(
-                send_reminder,
-                CronTrigger(hour=hours, minute=minutes),
-                args=[callback.message],
-                id=f"reminder_{user_id}",
-            )
 
             await callback.message.answer("Уведомления запущены!")
             await callback.message.delete()
@@ -48,23 +41,17 @@ async def start_notifications(callback: CallbackQuery, state: FSMContext):
         )
         await state.set_state(ReminderState.time)
 
-    if not scheduler.running:
-        scheduler.start()
-
 
 @router.callback_query(F.data == "reminder_off")
-async def stop_notifications(callback: CallbackQuery):
+async def stop_notifications(callback: CallbackQuery, user_context: UserContext):
     user_id = callback.from_user.id
 
-    db.update_reminder_status(user_id, False)
-
-    existing_job = scheduler.get_job(f"reminder_{user_id}")
-    if existing_job:
-        existing_job.remove()
+    if user_context.is_reminder_on:
+        await adb.update_reminder_status(user_id, False)
         await callback.message.answer("Уведомления остановлены")
         await callback.message.delete()
         await callback.message.answer(
-            f"Меню напоминаний\nВаши уведомления: Выключены ❌\nСохраненное время ⏰: {db.get_reminder_time(user_id)}",
+            f"Меню напоминаний\nВаши уведомления: Выключены ❌\nСохраненное время ⏰: {user_context.remind_time}",
             reply_markup=reminder_inline_kb,
         )
     else:
@@ -72,9 +59,6 @@ async def stop_notifications(callback: CallbackQuery):
             "Уведомления уже остановлены или не были запущены"
         )
 
-    if not scheduler.running:
-        scheduler.start()
-
 
 @router.message(ReminderState.time)
 async def save_reminder_time(message: Message, state: FSMContext):
@@ -89,17 +73,10 @@ async def save_reminder_time(message: Message, state: FSMContext):
         job_id = f"reminder_{user_id}"
         remind_time = f"{hours:02}:{minutes:02}"
 
-        db.add_reminder(
+        await adb.add_reminder(
             job_id=job_id, user_id=user_id, remind_time=remind_time, is_reminder_on=True
         )
 
-        scheduler.add_job(
-            send_reminder,
-            CronTrigger(hour=hours, minute=minutes),
-            args=[message],
-            id=job_id,
-        )
-
         await message.answer("Уведомления запущены!")
         await message.answer(
             f"Меню напоминаний\nВаши уведомления: Включены ✅\nСохраненное время ⏰: {remind_time}",
@@ -112,11 +89,10 @@ async def save_reminder_time(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data == "change_reminder_time")
-async def change_reminder_time(callback: CallbackQuery, state: FSMContext):
-    user_id = callback.from_user.id
-
-    reminder = db.is_reminder_exist(user_id)
-    if not reminder:
+async def change_reminder_time(
+    callback: CallbackQuery, state: FSMContext, user_context: UserContext
+):
+    if not user_context.reminder:
         await callback.message.answer("У вас нет активных напоминаний для изменения.")
         return
 
@@ -128,7 +104,9 @@ async def change_reminder_time(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(ReminderState.time_change)
-async def save_changed_reminder_time(message: Message, state: FSMContext):
+async def save_changed_reminder_time(
+    message: Message, state: FSMContext, user_context: UserContext
+):
     user_id = message.from_user.id
     time = message.text.strip()
 
@@ -137,28 +115,13 @@ async def save_changed_reminder_time(message: Message, state: FSMContext):
         if not (0 <= hours < 24 and 0 <= minutes < 60):
             raise ValueError
 
-        job_id = f"reminder_{user_id}"
         remind_time = f"{hours:02}:{minutes:02}"
 
-        db.update_reminder_time(user_id, remind_time)
-
-        existing_job = scheduler.get_job(job_id)
-        if existing_job:
-            existing_job.remove()
-
-        if db.check_is_reminder_on(user_id):
-            scheduler.add_job(
-                send_reminder,
-                CronTrigger(hour=hours, minute=minutes),
-                args=[message],
-                id=job_id,
-            )
-
-        scheduler.get_job(job_id)
+        await adb.update_reminder_time(user_id, remind_time)
 
         await message.answer(f"Время напоминания изменено на {remind_time}.")
         await message.answer(
-            f"Меню напоминаний\nВаши уведомления:{'Включены ✅' if scheduler.get_job(job_id) else 'Выключены ❌'}\nСохраненное время ⏰: {remind_time}",
+            f"Меню напоминаний\nВаши уведомления:{'Включены ✅' if user_context.is_reminder_on else 'Выключены ❌'}\nСохраненное время ⏰: {remind_time}",
             reply_markup=reminder_inline_kb,
         )
     except ValueError:
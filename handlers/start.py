@@ -3,7 +3,7 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message, ReplyKeyboardRemove
 
-from database import db
+from database import UserContext, adb
 from keyboards.menu import choose_target_kb, main_menu_kb
 from states.registration import RegistrationState
 
@@ -11,13 +11,12 @@ router = Router()
 
 
 @router.message(Command("start"))
-async def start_command(message: Message, state: FSMContext):
+async def start_command(message: Message, state: FSMContext, user_context: UserContext):
     # Сбрасываем состояние
     await state.clear()
 
-    if db.is_user_registered(message.from_user.id):
-        fullname = db.get_user_firstname(message.from_user.id)
-        await message.answer(f"Добро пожаловать, {fullname}!")
+    if user_context.registered:
+        await message.answer(f"Добро пожаловать, {user_context.first_name}!")
     else:
         await message.answer("Пожалуйста, введите ваше имя:")
         await state.set_state(RegistrationState.first_name)
@@ -51,7 +50,7 @@ async def process_age(message: Message, state: FSMContext):
 async def process_target(callback: CallbackQuery, state: FSMContext):
     target = callback.data
     data = await state.get_data()
-    db.register_user(
+    await adb.register_user(
         callback.from_user.id,
         callback.from_user.username or "Unknown",
         data["first_name"],
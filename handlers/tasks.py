@@ -1,31 +1,37 @@
 import logging
+from contextlib import aclosing
 
 from aiogram import F, Router
 from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
 
-from AI import check_answer_with_gigachat, generate_task_with_gigachat
-from database import db
-from helpers import category_map
+from AI import CircuitOpenError, check_answer_stream, generate_task
+from config import settings
+from database import UserContext, adb
+from helpers import ThrottledEditor, category_map
 from keyboards.tasks import break_inline_kb, tasks_inline_kb
 from states.tasks import TasksState
+from task_pool import prefetcher, task_pool
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 
 @router.callback_query(F.data.startswith("task_") & ~F.data.endswith("_stop"))
-async def task_start(callback_query: CallbackQuery, state: FSMContext):
+async def task_start(
+    callback_query: CallbackQuery, state: FSMContext, user_context: UserContext
+):
     """Обработчик старта задания."""
     await state.clear()
+    prefetcher.discard(callback_query.from_user.id)
 
     category = category_map.get(callback_query.data)
     if category is None:
         await callback_query.message.answer("Неизвестная категория задания.")
         return
 
-    level = db.get_user_level(callback_query.from_user.id)
+    level = user_context.level
     logger.info(
         f"Начало задания: категория={category}, уровень={level}, пользователь={callback_query.from_user.id}"
     )
@@ -45,11 +51,51 @@ async def task_start(callback_query: CallbackQuery, state: FSMContext):
 async def task_stop(callback: CallbackQuery, state: FSMContext):
     """Завершение задания пользователем."""
     await state.clear()
+    prefetcher.discard(callback.from_user.id)
     await callback.message.answer("Тест Завершен.")
     await callback.message.answer("Меню Заданий", reply_markup=tasks_inline_kb)
     logger.info(f"Пользователь {callback.from_user.id} завершил тест.")
 
 
+async def pick_task(user_id: int, category: str, level: int):
+    """
+    Подбор задания, которое пользователь ещё не видел:
+    заранее подготовленное, из пула, из кэша в БД и только затем новое.
+    """
+    # Сначала задание, подготовленное заранее под этот исход, затем пул
+    generated = await prefetcher.take(user_id, category, level)
+    if generated is None:
+        generated = task_pool.get(category, level)
+    if generated is not None:
+        task_id = await adb.save_task(category, level, *generated[1:])
+        if await adb.claim_task(user_id, task_id):
+            return generated
+        # Пользователь это задание уже видел, а другим оно ещё пригодится
+        task_pool.put(category, level, generated)
+
+    cached = await adb.get_unseen_task(user_id, category, level)
+    if cached is not None:
+        task_id, generated = cached
+        await adb.claim_task(user_id, task_id)
+        return generated
+
+    # Промах везде — генерируем на месте
+    try:
+        generated = await generate_task(level=level, category=category)
+    except CircuitOpenError:
+        # GigaChat недоступен: подойдёт любое невиденное задание категории из кэша
+        cached = await adb.get_unseen_task(user_id, category, level, spread=level)
+        if cached is None:
+            raise
+        task_id, generated = cached
+        await adb.claim_task(user_id, task_id)
+        return generated
+
+    task_id = await adb.save_task(category, level, *generated[1:])
+    await adb.claim_task(user_id, task_id)
+    return generated
+
+
 async def send_next_question(message: Message, state: FSMContext):
     """Отправляет следующее задание пользователю."""
     data = await state.get_data()
@@ -57,9 +103,8 @@ async def send_next_question(message: Message, state: FSMContext):
     level = data.get("level")
 
     try:
-        # Получаем все данные, включая баллы за задание
-        category_name, task, correct_answer, points = await generate_task_with_gigachat(
-            level=level, category=category
+        category_name, task, correct_answer, points = await pick_task(
+            message.chat.id, category, level
         )
         if not task or not correct_answer:
             logger.warning(
@@ -84,6 +129,24 @@ async def send_next_question(message: Message, state: FSMContext):
 
     await message.answer(f"{category_name}\n\n{task}", reply_markup=break_inline_kb)
 
+    # Пока пользователь отвечает, готовим задания для обоих исходов
+    prefetcher.start(message.chat.id, category, level)
+
+
+@router.message(TasksState.expired)
+async def handle_expired_session(message: Message, state: FSMContext):
+    """Ответ на вопрос из сессии, которая истекла и была очищена."""
+    data = await state.get_data()
+    if message.text.strip().lower() == "стоп" or data.get("category") is None:
+        await state.clear()
+        await message.answer("Меню Заданий", reply_markup=tasks_inline_kb)
+        return
+
+    logger.info(f"Сессия пользователя {message.from_user.id} истекла, новое задание.")
+    await state.set_state(TasksState.question)
+    await message.answer("Сессия истекла, вот новое задание:")
+    await send_next_question(message, state)
+
 
 @router.message(TasksState.question)
 async def handle_user_answer(message: Message, state: FSMContext):
@@ -97,31 +160,53 @@ async def handle_user_answer(message: Message, state: FSMContext):
     user_answer = message.text.strip().lower()
     if user_answer == "стоп":
         await state.clear()
+        prefetcher.discard(message.from_user.id)
         await message.answer("Тест Завершен.")
         await message.answer("Меню Заданий", reply_markup=tasks_inline_kb)
         logger.info(f"Пользователь {message.from_user.id} завершил задание досрочно.")
         return
 
     try:
-        feedback = await check_answer_with_gigachat(
-            task=task, correct_answer=correct_answer, user_answer=user_answer
+        # Флаг правильности читается из первой строки сразу, как только она пришла,
+        # а текст для пользователя дописывается в сообщение по мере генерации
+        feedback = ""
+        correctness_flag = None
+        editor = ThrottledEditor(
+            message, prefix="Результат:\n", interval=settings.FEEDBACK_EDIT_INTERVAL
+        )
+        stream = check_answer_stream(
+            category=data.get("category"),
+            task=task,
+            correct_answer=correct_answer,
+            user_answer=user_answer,
         )
-        lines = feedback.split("\n", 1)
-        if len(lines) < 2 or lines[0].strip().lower() not in ["верно", "неверно"]:
+        async with aclosing(stream):
+            async for chunk in stream:
+                feedback += chunk
+                lines = feedback.lstrip().split("\n", 1)
+                if len(lines) < 2:
+                    continue
+
+                if correctness_flag is None:
+                    correctness_flag = lines[0].strip().lower()
+                    if correctness_flag not in ["верно", "неверно"]:
+                        break
+
+                await editor.update(lines[1].strip())
+
+        if correctness_flag not in ["верно", "неверно"]:
             logger.warning(
                 f"Некорректный формат ответа GigaChat для пользователя {message.from_user.id}: {feedback}"
             )
             await message.answer("Не удалось распознать результат. Попробуйте позже.")
             return
 
-        correctness_flag = lines[0].strip().lower()
-        user_feedback = lines[1].strip()
-
-        await message.answer(f"Результат:\n{user_feedback}")
+        await editor.finish()
 
         if correctness_flag == "верно":
             level += 1
-            db.update_user_rating(message.from_user.id, points)  # Обновляем рейтинг
+            # Обновляем рейтинг
+            await adb.update_user_rating(message.from_user.id, points)
             logger.info(
                 f"Пользователь {message.from_user.id} успешно прошёл задание. Новый уровень: {level}, добавлено баллов: {points}"
             )
@@ -136,10 +221,19 @@ async def handle_user_answer(message: Message, state: FSMContext):
             await message.answer("Ты ошибся, твой уровень понижен. Следующее задание:")
 
         await state.update_data(level=level)
-        db.update_user_level(message.from_user.id, level)
+        await adb.update_user_level(message.from_user.id, level)
 
         await send_next_question(message, state)
 
+    except CircuitOpenError:
+        # Вопрос остаётся тем же, уровень и рейтинг не меняются
+        logger.warning(
+            f"Проверка ответа пользователя {message.from_user.id} недоступна: GigaChat не отвечает"
+        )
+        await message.answer(
+            "Проверка ответов временно недоступна. Попробуйте ответить ещё раз чуть позже."
+        )
+
     except Exception as e:
         logger.error(
             f"Ошибка при проверке ответа пользователя {message.from_user.id}: {e}"
@@ -1,8 +1,13 @@
+from .answer_checker import check_answer_locally, compare_answers, normalize_answer
+from .bloom import BloomFilter, RotatingBloomFilter
 from .constants import (
+    LOCAL_CHECK_CATEGORIES,
     NO_REMINDER_TEXT,
     NOT_REGISTERED_MESSAGE,
     REMINDER_MENU_TEXT,
+    SURVEY_MESSAGE,
     WORKOUT_REMINDER_MESSAGE,
     category_map,
 )
 from .helpers_functions import format_rating_message, format_reminder_message
+from .throttled_editor import ThrottledEditor
@@ -0,0 +1,112 @@
+import re
+
+from .constants import LOCAL_CHECK_CATEGORIES
+
+NUMBER_RE = re.compile(r"-?\d+(?:[.,]\d+)?")
+TOKEN_RE = re.compile(r"-?\d+(?:\.\d+)?|[a-zа-я]+")
+# Число, записанное с разделителем разрядов: от одной до трёх цифр, затем группы
+# ровно по три цифры через неразрывный или узкий пробел ("1 000 000").
+# Обычный пробел не считается разделителем: "64 128" — это два числа
+THOUSANDS_RE = re.compile(r"(?<![\d.,])\d{1,3}(?:[\u00a0\u2009\u202f]\d{3})+(?![\d.,])")
+# Минус и тире, которыми часто записывают отрицательные числа
+DASHES = str.maketrans({"\u2212": "-", "\u2013": "-"})
+
+# Слова-связки вокруг ответа: "мой ответ 42", "наверное это кот"
+STOPWORDS = {
+    "это",
+    "ответ",
+    "мой",
+    "наверное",
+    "думаю",
+    "кажется",
+    "я",
+    "по",
+    "моему",
+    "будет",
+    "лишний",
+    "лишнее",
+    "лишняя",
+    "слово",
+    "число",
+    "элемент",
+}
+
+
+def normalize_answer(text: str) -> str:
+    """Приведение ответа к каноническому виду: регистр, ё/е, числа, пунктуация."""
+    text = text.lower().replace("ё", "е").translate(DASHES).strip()
+    text = THOUSANDS_RE.sub(lambda match: re.sub(r"\D", "", match.group()), text)
+    text = re.sub(r"(?<=\d),(?=\d)", ".", text)
+    return " ".join(_normalize_token(token) for token in TOKEN_RE.findall(text))
+
+
+def _normalize_token(token: str) -> str:
+    if NUMBER_RE.fullmatch(token):
+        number = float(token)
+        return str(int(number)) if number.is_integer() else str(number)
+    return token
+
+
+def _content_tokens(text: str) -> list[str]:
+    """Значимые слова ответа без связок; при отрицании ("не кот") — пусто."""
+    tokens = normalize_answer(text).split()
+    if "не" in tokens:
+        return []
+    return [token for token in tokens if token not in STOPWORDS]
+
+
+def _is_number(token: str) -> bool:
+    return NUMBER_RE.fullmatch(token) is not None
+
+
+def _same_stem(first: str, second: str) -> bool:
+    """Совпадение основ слов, чтобы не считать ошибкой другое окончание."""
+    length = max(3, min(len(first), len(second)) - 2)
+    return first[:length] == second[:length]
+
+
+def _verdict(correct: bool, correct_answer: str) -> str:
+    correct_answer = correct_answer.strip().rstrip(".")
+    if correct:
+        return f"верно\nМолодец! Ты ответил верно. Правильный ответ: {correct_answer}."
+    return (
+        f"неверно\nК сожалению, это неверно. Правильный ответ: {correct_answer}. "
+        "Попробуй ещё раз!"
+    )
+
+
+def check_answer_locally(category: str, correct_answer: str, user_answer: str):
+    """
+    Локальная проверка коротких ответов без обращения к GigaChat.
+    Возвращает ответ в формате "верно/неверно + сообщение"
+    или None, если однозначно решить нельзя. Решение принимается, только
+    если в ответе одно значимое слово или число: перечисление вариантов
+    ("кот или собака") отдаётся на проверку GigaChat.
+    """
+    if category not in LOCAL_CHECK_CATEGORIES:
+        return None
+
+    expected = _content_tokens(correct_answer)
+    given = _content_tokens(user_answer)
+    if len(expected) != 1 or len(given) != 1:
+        return None
+    expected, given = expected[0], given[0]
+
+    if given == expected:
+        return _verdict(True, correct_answer)
+    # Число против слова ("8" и "восемь") сравнить нельзя
+    if _is_number(given) != _is_number(expected):
+        return None
+    if not _is_number(given) and _same_stem(given, expected):
+        return None
+    return _verdict(False, correct_answer)
+
+
+def compare_answers(correct_answer: str, user_answer: str) -> str:
+    """
+    Упрощённая проверка для любой категории, когда GigaChat недоступен:
+    ответ верен, если совпадает с правильным после нормализации.
+    """
+    expected = normalize_answer(correct_answer)
+    given = normalize_answer(user_answer)
+    return _verdict(bool(given) and given == expected, correct_answer)
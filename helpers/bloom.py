@@ -0,0 +1,90 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Компактное множество целых чисел с возможными ложными срабатываниями.
+    Хранится как bytes, чтобы лежать в БД одним BLOB.
+    """
+
+    def __init__(self, data: bytes = None, size_bits: int = 8192, hashes: int = 3):
+        self.size_bits = len(data) * 8 if data else size_bits
+        self.hashes = hashes
+        self.bits = bytearray(data) if data else bytearray(size_bits // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float, hashes: int = 3):
+        """Пустой фильтр, у которого после capacity ключей ложных срабатываний error_rate."""
+        size_bits = -hashes * capacity / math.log(1 - error_rate ** (1 / hashes))
+        return cls(size_bits=math.ceil(size_bits / 8) * 8, hashes=hashes)
+
+    def _positions(self, key: int):
+        digest = hashlib.blake2b(key.to_bytes(8, "little", signed=True)).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:16], "little") | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size_bits
+
+    def add(self, key: int) -> bool:
+        """Добавить ключ. Возвращает False, если ключ, вероятно, уже был."""
+        added = False
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                added = True
+        return added
+
+    def __contains__(self, key: int) -> bool:
+        return all(
+            self.bits[position // 8] & (1 << (position % 8))
+            for position in self._positions(key)
+        )
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.bits)
+
+
+class RotatingBloomFilter:
+    """
+    Два поколения BloomFilter: когда в текущее добавлено capacity ключей,
+    оно становится предыдущим, а прежнее предыдущее отбрасывается.
+    Доля ложных срабатываний не растёт со временем (не больше 2 * error_rate),
+    зато ключи старше двух поколений забываются.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        error_rate: float,
+        current: bytes = None,
+        previous: bytes = None,
+        count: int = 0,
+    ):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.current = (
+            BloomFilter(current)
+            if current
+            else BloomFilter.for_capacity(capacity, error_rate)
+        )
+        self.previous = BloomFilter(previous) if previous else None
+        self.count = count
+
+    def add(self, key: int) -> bool:
+        """Добавить ключ. Возвращает False, если ключ, вероятно, уже был."""
+        if key in self:
+            return False
+        if self.count >= self.capacity:
+            self.previous = self.current
+            self.current = BloomFilter.for_capacity(self.capacity, self.error_rate)
+            self.count = 0
+        self.current.add(key)
+        self.count += 1
+        return True
+
+    def __contains__(self, key: int) -> bool:
+        return key in self.current or (
+            self.previous is not None and key in self.previous
+        )
@@ -2,6 +2,7 @@ NOT_REGISTERED_MESSAGE = (
     "Вы не зарегистрированы. Пожалуйста, начните регистрацию, вызвав команду /start."
 )
 WORKOUT_REMINDER_MESSAGE = "Время приступить к тренировкам!"
+SURVEY_MESSAGE = "Привет! Пожалуйста, уделите минуту, чтобы заполнить анкету о нашем боте: [Заполнить анкету](https://example.com/survey)"
 
 
 REMINDER_MENU_TEXT = (
@@ -16,3 +17,9 @@ category_map = {
     "task_find_order": "Распознавание последовательностей",
     "task_memory": "Тест на память",
 }
+
+# Категории, в которых ответ обычно одно число или слово и проверяется локально
+LOCAL_CHECK_CATEGORIES = {
+    "Найти лишний элемент",
+    "Распознавание последовательностей",
+}
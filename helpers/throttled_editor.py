@@ -0,0 +1,51 @@
+import logging
+import time
+
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+
+class ThrottledEditor:
+    """
+    Сообщение, которое дописывается по мере поступления текста.
+    Правки не чаще одной за interval секунд, чтобы не упереться в лимиты Telegram.
+    """
+
+    def __init__(self, message: Message, prefix: str = "", interval: float = 1.0):
+        self.message = message
+        self.prefix = prefix
+        self.interval = interval
+        self.sent: Message | None = None
+        self.text = ""
+        self._shown = ""
+        self._last_edit = 0.0
+
+    async def update(self, text: str) -> None:
+        """Обновить текст; сообщение правится, только если прошёл интервал."""
+        self.text = text
+        if not text.strip():
+            return
+        if self.sent is None or time.monotonic() - self._last_edit >= self.interval:
+            await self._flush()
+
+    async def finish(self) -> None:
+        """Показать окончательный текст."""
+        await self._flush()
+
+    async def _flush(self) -> None:
+        text = f"{self.prefix}{self.text}".strip()
+        if text == self._shown:
+            return
+
+        try:
+            if self.sent is None:
+                self.sent = await self.message.answer(text)
+            else:
+                await self.sent.edit_text(text)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить сообщение: {e}")
+            return
+
+        self._shown = text
+        self._last_edit = time.monotonic()
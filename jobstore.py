@@ -0,0 +1,196 @@
+import asyncio
+import pickle
+import sqlite3
+
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+
+from database import AsyncDatabaseManager, DatabaseManager
+
+
+class SQLiteJobStore(BaseJobStore):
+    """
+    Хранилище задач APScheduler в таблице apscheduler_jobs той же базы SQLite.
+    Повторяет SQLAlchemyJobStore, но работает через соединение DatabaseManager
+    и не требует SQLAlchemy. Задачи переживают перезапуск, поэтому их аргументы
+    должны сериализоваться pickle (id чатов, а не объекты Message).
+    Методы синхронные: вызывать их нужно в потоке БД (см. DatabaseThreadScheduler).
+    """
+
+    def __init__(self, db: DatabaseManager, pickle_protocol=pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.db = db
+        self.pickle_protocol = pickle_protocol
+
+    def is_empty(self) -> bool:
+        with self.db.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM apscheduler_jobs LIMIT 1")
+            return cursor.fetchone() is None
+
+    def lookup_job(self, job_id):
+        with self.db.cursor() as cursor:
+            cursor.execute(
+                "SELECT job_state FROM apscheduler_jobs WHERE id = ?", (job_id,)
+            )
+            row = cursor.fetchone()
+        return self._reconstitute_job(row[0]) if row else None
+
+    def get_due_jobs(self, now):
+        return self._get_jobs(
+            "WHERE next_run_time <= ?", (datetime_to_utc_timestamp(now),)
+        )
+
+    def get_next_run_time(self):
+        with self.db.cursor() as cursor:
+            cursor.execute(
+                """SELECT next_run_time FROM apscheduler_jobs
+                   WHERE next_run_time IS NOT NULL
+                   ORDER BY next_run_time
+                   LIMIT 1"""
+            )
+            row = cursor.fetchone()
+        return utc_timestamp_to_datetime(row[0]) if row else None
+
+    def get_all_jobs(self):
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+
+    def add_job(self, job):
+        try:
+            with self.db.cursor() as cursor:
+                cursor.execute(
+                    """INSERT INTO apscheduler_jobs (id, next_run_time, job_state)
+                       VALUES (?, ?, ?)""",
+                    (
+                        job.id,
+                        datetime_to_utc_timestamp(job.next_run_time),
+                        pickle.dumps(job.__getstate__(), self.pickle_protocol),
+                    ),
+                )
+        except sqlite3.IntegrityError:
+            raise ConflictingIdError(job.id)
+
+    def update_job(self, job):
+        with self.db.cursor() as cursor:
+            cursor.execute(
+                """UPDATE apscheduler_jobs SET next_run_time = ?, job_state = ?
+                   WHERE id = ?""",
+                (
+                    datetime_to_utc_timestamp(job.next_run_time),
+                    pickle.dumps(job.__getstate__(), self.pickle_protocol),
+                    job.id,
+                ),
+            )
+            if cursor.rowcount == 0:
+                raise JobLookupError(job.id)
+
+    def remove_job(self, job_id):
+        with self.db.cursor() as cursor:
+            cursor.execute("DELETE FROM apscheduler_jobs WHERE id = ?", (job_id,))
+            if cursor.rowcount == 0:
+                raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        with self.db.cursor() as cursor:
+            cursor.execute("DELETE FROM apscheduler_jobs")
+
+    def shutdown(self):
+        # Соединение принадлежит DatabaseManager и закрывается вместе с ним
+        pass
+
+    def _reconstitute_job(self, job_state):
+        job_state = pickle.loads(job_state)
+        job_state["jobstore"] = self
+        job = Job.__new__(Job)
+        job.__setstate__(job_state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _get_jobs(self, condition: str = "", params: tuple = ()):
+        jobs = []
+        failed_job_ids = []
+        with self.db.cursor() as cursor:
+            cursor.execute(
+                f"""SELECT id, job_state FROM apscheduler_jobs {condition}
+                    ORDER BY next_run_time""",
+                params,
+            )
+            rows = cursor.fetchall()
+
+        for job_id, job_state in rows:
+            try:
+                jobs.append(self._reconstitute_job(job_state))
+            except BaseException:
+                self._logger.exception(
+                    f'Не удалось восстановить задачу "{job_id}", она удалена'
+                )
+                failed_job_ids.append(job_id)
+
+        # Задачи, которые не удалось восстановить, удаляются
+        if failed_job_ids:
+            with self.db.cursor() as cursor:
+                cursor.executemany(
+                    "DELETE FROM apscheduler_jobs WHERE id = ?",
+                    [(job_id,) for job_id in failed_job_ids],
+                )
+
+        return jobs
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} ({self.db.db_file})>"
+
+
+class ThreadSafeAsyncIOExecutor(AsyncIOExecutor):
+    """AsyncIOExecutor, которому можно передавать задачи из другого потока."""
+
+    def _do_submit_job(self, job, run_times):
+        # Задачи-корутины создаются только в потоке цикла событий
+        self._eventloop.call_soon_threadsafe(super()._do_submit_job, job, run_times)
+
+
+class DatabaseThreadScheduler(AsyncIOScheduler):
+    """
+    AsyncIOScheduler, который обрабатывает задачи (выборка готовых задач
+    и запись следующего запуска в хранилище) в потоке БД AsyncDatabaseManager,
+    как и все остальные запросы к БД, а не в цикле событий. Поэтому цикл
+    событий не ждёт ни диска, ни блокировки соединения, пока поток БД
+    записывает накопленные изменения. Сами задачи выполняются в цикле событий.
+    """
+
+    def __init__(self, adb: AsyncDatabaseManager, **options):
+        self.adb = adb
+        self._processing: asyncio.Task | None = None
+        self._wakeup_again = False
+        super().__init__(**options)
+
+    def wakeup(self):
+        # Вызывается и из цикла событий, и из потока БД
+        self._eventloop.call_soon_threadsafe(self._schedule_processing)
+
+    def _schedule_processing(self):
+        self._stop_timer()
+        if self._processing is not None and not self._processing.done():
+            # Обработка уже идёт: после неё пройдём по задачам ещё раз
+            self._wakeup_again = True
+            return
+        self._processing = self._eventloop.create_task(self._process_in_db_thread())
+
+    async def _process_in_db_thread(self):
+        while True:
+            self._wakeup_again = False
+            try:
+                wait_seconds = await self.adb.run(self._process_jobs)
+            except Exception:
+                self._logger.exception("Ошибка обработки задач планировщика")
+                wait_seconds = self.jobstore_retry_interval
+            if not self._wakeup_again:
+                break
+        self._start_timer(wait_seconds)
+
+    def _create_default_executor(self):
+        return ThreadSafeAsyncIOExecutor()
@@ -42,3 +42,22 @@ choose_target = [
 ]
 
 choose_target_kb = get_inline_keyboard(choose_target)
+
+
+def get_rating_page_kb(page: int, has_next: bool) -> InlineKeyboardMarkup:
+    """Кнопки листания рейтинга."""
+    row = []
+    if page > 0:
+        row.append(
+            InlineKeyboardButton(text="◀️", callback_data=f"rating_page_{page - 1}")
+        )
+    if has_next:
+        row.append(
+            InlineKeyboardButton(text="▶️", callback_data=f"rating_page_{page + 1}")
+        )
+    return InlineKeyboardMarkup(inline_keyboard=[row])
+
+
+rating_full_kb = get_inline_keyboard(
+    [{"text": "Весь рейтинг", "callback_data": "rating_page_0"}]
+)
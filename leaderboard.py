@@ -0,0 +1,211 @@
+import bisect
+
+
+class FenwickTree:
+    """Дерево Фенвика: число пользователей с каждым значением рейтинга."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._tree = [0] * (size + 1)
+
+    @classmethod
+    def from_counts(cls, counts: list[int]) -> "FenwickTree":
+        """Построение за O(n) по готовым количествам."""
+        fenwick = cls(len(counts))
+        tree = fenwick._tree
+        tree[1:] = counts
+        for i in range(1, fenwick.size + 1):
+            parent = i + (i & -i)
+            if parent <= fenwick.size:
+                tree[parent] += tree[i]
+        return fenwick
+
+    def add(self, index: int, delta: int) -> None:
+        i = index + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix(self, index: int) -> int:
+        """Сумма по индексам 0..index включительно."""
+        total = 0
+        i = min(index + 1, self.size)
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, k: int) -> int:
+        """Наименьший индекс, у которого префиксная сумма не меньше k (k >= 1)."""
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            next_position = position + step
+            if next_position <= self.size and self._tree[next_position] < k:
+                position = next_position
+                k -= self._tree[next_position]
+            step >>= 1
+        return position
+
+
+class Leaderboard:
+    """
+    Рейтинг пользователей в памяти.
+    Дерево Фенвика по значениям рейтинга даёт место пользователя и переход
+    к нужной позиции за O(log n); внутри одного значения рейтинга пользователи
+    хранятся отсортированными по id. Рейтинг неотрицательный, пользователи
+    с одинаковым рейтингом делят одно место, как и в запросе COUNT(*) + 1.
+
+    Размер дерева ограничен max_size: все рейтинги от max_size - 1 и выше
+    попадают в последнюю ячейку, внутри которой пользователи отсортированы
+    по убыванию рейтинга, затем по id.
+    """
+
+    def __init__(self, initial_size: int = 1024, max_size: int = 1 << 16):
+        self.loaded = False
+        self.max_size = max_size
+        self._ratings: dict[int, int] = {}
+        self._buckets: dict[int, list[int]] = {}
+        self._counts = FenwickTree(min(initial_size, max_size))
+
+    def _index(self, rating: int) -> int:
+        return min(rating, self.max_size - 1)
+
+    def _overflow_key(self, user_id: int) -> tuple[int, int]:
+        return -self._ratings[user_id], user_id
+
+    def _position(self, index: int, user_id: int, rating: int) -> int:
+        """Позиция пользователя в ячейке index."""
+        users = self._buckets[index]
+        if index < self.max_size - 1:
+            return bisect.bisect_left(users, user_id)
+        return bisect.bisect_left(users, (-rating, user_id), key=self._overflow_key)
+
+    def load(self, rows) -> None:
+        """Загрузка пар (user_id, рейтинг)."""
+        self._ratings = {user_id: max(rating, 0) for user_id, rating in rows}
+        self._buckets = {}
+        for user_id, rating in self._ratings.items():
+            self._buckets.setdefault(self._index(rating), []).append(user_id)
+
+        size = self._counts.size
+        top = max(self._buckets, default=0)
+        while size <= top:
+            size *= 2
+        counts = [0] * min(size, self.max_size)
+        for index, users in self._buckets.items():
+            if index < self.max_size - 1:
+                users.sort()
+            else:
+                users.sort(key=self._overflow_key)
+            counts[index] = len(users)
+        self._counts = FenwickTree.from_counts(counts)
+        self.loaded = True
+
+    def invalidate(self) -> None:
+        """Сбросить рейтинг; до следующей загрузки запросы идут в БД."""
+        self.loaded = False
+        self._ratings = {}
+        self._buckets = {}
+        self._counts = FenwickTree(self._counts.size)
+
+    def _grow(self, index: int) -> None:
+        size = self._counts.size
+        while size <= index:
+            size *= 2
+        counts = [0] * min(size, self.max_size)
+        for value, users in self._buckets.items():
+            counts[value] = len(users)
+        self._counts = FenwickTree.from_counts(counts)
+
+    def add(self, user_id: int, points: int) -> None:
+        """Начислить пользователю баллы (как UPSERT rating = rating + ?)."""
+        if not self.loaded:
+            return
+
+        old = self._ratings.get(user_id)
+        new = max((old or 0) + points, 0)
+        if old == new:
+            return
+
+        if old is not None:
+            index = self._index(old)
+            users = self._buckets[index]
+            del users[self._position(index, user_id, old)]
+            if not users:
+                del self._buckets[index]
+            self._counts.add(index, -1)
+
+        index = self._index(new)
+        if index >= self._counts.size:
+            self._grow(index)
+        users = self._buckets.setdefault(index, [])
+        users.insert(self._position(index, user_id, new), user_id)
+        self._counts.add(index, 1)
+        self._ratings[user_id] = new
+
+    def set(self, user_id: int, rating: int) -> None:
+        """Установить рейтинг пользователя (значение из БД)."""
+        self.add(user_id, rating - self._ratings.get(user_id, 0))
+
+    def rating(self, user_id: int) -> int | None:
+        return self._ratings.get(user_id)
+
+    def rank(self, user_id: int) -> int | None:
+        """Место пользователя (с 1) или None, если его нет в рейтинге."""
+        rating = self._ratings.get(user_id)
+        if rating is None:
+            return None
+        index = self._index(rating)
+        higher = len(self._ratings) - self._counts.prefix(index)
+        if index == self.max_size - 1:
+            higher += bisect.bisect_left(
+                self._buckets[index], (-rating,), key=self._overflow_key
+            )
+        return higher + 1
+
+    def page(self, offset: int, limit: int) -> list[tuple[int, int]]:
+        """Пользователи на позициях offset..offset+limit-1 (с 0) по убыванию рейтинга."""
+        total = len(self._ratings)
+        if offset < 0 or offset >= total or limit <= 0:
+            return []
+
+        # Позиция offset по убыванию — это (total - offset)-я по возрастанию
+        k = total - offset
+        index = self._counts.find(k)
+        below = self._counts.prefix(index - 1) if index > 0 else 0
+        # Сколько пользователей этой ячейки уже пропущено сверху
+        skip = self._counts.prefix(index) - k
+
+        result = []
+        while len(result) < limit:
+            users = self._buckets[index]
+            for user_id in users[skip : skip + limit - len(result)]:
+                result.append((user_id, self._ratings[user_id]))
+            if below == 0:
+                break
+            index = self._counts.find(below)
+            below -= len(self._buckets[index])
+            skip = 0
+        return result
+
+    def around(self, user_id: int, radius: int) -> tuple[int, list[tuple[int, int]]]:
+        """
+        Окно из radius соседей сверху и снизу от пользователя.
+        Возвращает (позицию первого элемента окна с 1, список (user_id, рейтинг)).
+        """
+        rating = self._ratings.get(user_id)
+        if rating is None:
+            return 0, []
+
+        index = self._index(rating)
+        position = (
+            len(self._ratings)
+            - self._counts.prefix(index)
+            + self._position(index, user_id, rating)
+        )
+        offset = max(position - radius, 0)
+        return offset + 1, self.page(offset, position - offset + radius + 1)
+
+    def __len__(self) -> int:
+        return len(self._ratings)
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+
+from config import settings
+from database import adb
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLease:
+    """
+    Выбор лидера среди процессов бота через аренду в таблице leases.
+    Каждые heartbeat секунд процесс берёт или продлевает аренду на ttl секунд.
+    Получив её, вызывает on_acquired, а потеряв (аренду перехватили или
+    продлить не удалось до истечения срока) — on_lost. Если лидер упал,
+    другой процесс получит аренду не позже чем через ttl + heartbeat секунд.
+
+    Токен растёт при каждой смене владельца. Перед каждой пачкой рассылки
+    holds() сверяет его с БД, так что процесс, который завис и потерял
+    аренду, не продолжит рассылку параллельно с новым лидером.
+
+    Рядом с арендой хранится прогресс работы лидера (load_progress и
+    save_progress), чтобы новый лидер продолжил с того места, где остановился
+    прежний. Сохранение проверяет токен, так что потерявший аренду процесс
+    не перезапишет прогресс нового лидера.
+    """
+
+    def __init__(self, name: str, ttl: float, heartbeat: float):
+        self.name = name
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.token: int | None = None
+        # До этого момента (по monotonic) аренда точно не истекла в БД
+        self._valid_until = 0.0
+        self._task: asyncio.Task | None = None
+        self._on_acquired = None
+        self._on_lost = None
+
+        self.acquired = 0
+        self.lost = 0
+
+    @property
+    def is_leader(self) -> bool:
+        return self.token is not None and time.monotonic() < self._valid_until
+
+    async def holds(self) -> bool:
+        """Аренда у этого процесса: по локальному сроку и по токену в БД."""
+        if not self.is_leader:
+            return False
+        try:
+            return await adb.check_lease(self.name, self.holder, self.token)
+        except Exception as e:
+            logger.error(f"Не удалось проверить аренду {self.name}: {e}")
+            return False
+
+    async def load_progress(self) -> str | None:
+        """Прогресс, сохранённый последним лидером, или None."""
+        return await adb.get_lease_progress(self.name)
+
+    async def save_progress(self, progress: str) -> bool:
+        """Сохранить прогресс; False, если аренда уже не у этого процесса."""
+        if not self.is_leader:
+            return False
+        return await adb.save_lease_progress(
+            self.name, self.holder, self.token, progress
+        )
+
+    def start(self, on_acquired, on_lost) -> None:
+        self._on_acquired = on_acquired
+        self._on_lost = on_lost
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await self._renew()
+            await asyncio.sleep(self.heartbeat)
+
+    async def _renew(self) -> None:
+        # Срок отсчитывается от начала запроса, поэтому локально
+        # аренда истекает не позже, чем в БД
+        started = time.monotonic()
+        try:
+            token = await adb.acquire_lease(self.name, self.holder, self.ttl)
+        except Exception as e:
+            logger.error(f"Не удалось продлить аренду {self.name}: {e}")
+            if self.token is not None and not self.is_leader:
+                await self._lose()
+            return
+
+        if token is None:
+            if self.token is not None:
+                await self._lose()
+            return
+
+        self._valid_until = started + self.ttl
+        if token != self.token:
+            if self.token is not None:
+                await self._lose()
+            self.token = token
+            self.acquired += 1
+            logger.info(f"Процесс {self.holder} стал лидером (токен {token})")
+            try:
+                await self._on_acquired()
+            except Exception as e:
+                logger.error(f"Ошибка при получении лидерства: {e}")
+
+    async def _lose(self) -> None:
+        logger.warning(f"Процесс {self.holder} больше не лидер (токен {self.token})")
+        self.token = None
+        self.lost += 1
+        try:
+            await self._on_lost()
+        except Exception as e:
+            logger.error(f"Ошибка при потере лидерства: {e}")
+
+    async def close(self) -> None:
+        """Остановить продление и освободить аренду для другого процесса."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        if self.token is not None:
+            await self._lose()
+            try:
+                await adb.release_lease(self.name, self.holder)
+            except Exception as e:
+                logger.error(f"Не удалось освободить аренду {self.name}: {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "leader": self.is_leader,
+            "token": self.token,
+            "acquired": self.acquired,
+            "lost": self.lost,
+        }
+
+
+leader_lease = LeaderLease(
+    name="scheduler",
+    ttl=settings.LEADER_LEASE_TTL,
+    heartbeat=settings.LEADER_HEARTBEAT_INTERVAL,
+)
@@ -3,7 +3,7 @@ import logging
 from aiogram import BaseMiddleware
 from aiogram.types import Message, ReplyKeyboardRemove
 
-from database import db
+from database import adb, db
 from helpers import NOT_REGISTERED_MESSAGE
 
 logger = logging.getLogger(__name__)
@@ -18,7 +18,18 @@ class RegistrationMiddleware(BaseMiddleware):
                 if state is not None and await state.get_state() is not None:
                     return await handler(event, data)
 
-                if not db.is_user_registered(user_id) and event.text != "/start":
+                # Индекс в памяти отвечает без запроса к БД, пока он загружен.
+                # Промах проверяется в БД: пользователь мог зарегистрироваться
+                # через другой процесс бота
+                registered = (
+                    db.registered_users.loaded and user_id in db.registered_users
+                )
+                if not registered:
+                    registered = await adb.is_user_registered(user_id)
+                    if registered:
+                        db.registered_users.add(user_id)
+
+                if not registered and event.text != "/start":
                     await event.answer(
                         NOT_REGISTERED_MESSAGE,
                         reply_markup=ReplyKeyboardRemove(),
@@ -37,3 +48,19 @@ class RegistrationMiddleware(BaseMiddleware):
             if isinstance(event, Message):
                 await event.answer("Произошла ошибка. Попробуйте позже.")
             return None
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Загружает контекст пользователя (профиль, напоминание, рейтинг) один раз
+    на апдейт и передаёт его обработчикам как user_context.
+    """
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None:
+            context = db.user_contexts.get(user.id)
+            if context is None:
+                context = await adb.load_user_context(user.id)
+            data["user_context"] = context
+        return await handler(event, data)
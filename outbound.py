@@ -0,0 +1,299 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+
+from config import settings
+from database import adb
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ведро токенов: не больше rate событий в секунду, с запасом capacity."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        # Пауза по TelegramRetryAfter: до этого момента токены не выдаются
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass(eq=False)
+class OutboundMessage:
+    chat_id: int
+    text: str
+    kind: str
+    kwargs: dict
+    done: asyncio.Future
+    attempts: int = 0
+
+
+class OutboundEngine:
+    """
+    Очередь исходящих сообщений для рассылок (напоминания, анкеты).
+    Отправители берут сообщения из общей очереди и соблюдают лимиты Telegram:
+    общий (ведро токенов на rate сообщений в секунду) и для каждого чата
+    (не чаще раза в chat_interval). TelegramRetryAfter приостанавливает
+    всю отправку на указанное время, временные ошибки повторяются с паузой,
+    а сообщения, которые так и не удалось доставить, пишутся в dead_letters.
+    """
+
+    # Результат доставки: доставлено, не доставлено (можно повторить позже)
+    # и отклонено получателем (бот заблокирован, чат удалён) — повторять бесполезно
+    DELIVERED = "delivered"
+    FAILED = "failed"
+    REJECTED = "rejected"
+
+    # Ошибки TelegramBadRequest, которые относятся к получателю, а не к сообщению
+    REJECTED_ERRORS = ("chat not found", "user is deactivated")
+
+    # Окно для расчёта скорости доставки, секунды
+    RATE_WINDOW = 60.0
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        chat_interval: float,
+        senders: int,
+        max_attempts: int,
+        queue_size: int,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.chat_interval = chat_interval
+        self.senders = senders
+        self.max_attempts = max_attempts
+        self._queue: asyncio.Queue[OutboundMessage] = asyncio.Queue(queue_size)
+        # Когда в чат можно отправить следующее сообщение
+        self._chat_ready_at: dict[int, float] = {}
+        self._workers: list[asyncio.Task] = []
+        # Повторы, ждущие возвращения в очередь, и сообщения у отправителей
+        self._retries: dict[asyncio.Task, OutboundMessage] = {}
+        self._in_flight: set[OutboundMessage] = set()
+        self._sent_at: deque[float] = deque()
+        self.bot: Bot | None = None
+
+        self.sent = 0
+        self.retried = 0
+        self.throttled = 0
+        self.dead = 0
+
+    def start(self, bot: Bot) -> None:
+        self.bot = bot
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.senders)]
+
+    async def submit(
+        self, chat_id: int, text: str, kind: str = "message", **kwargs
+    ) -> asyncio.Future:
+        """
+        Поставить сообщение в очередь (ждёт, если очередь заполнена).
+        Возвращает future с результатом доставки: DELIVERED, FAILED
+        или REJECTED (в двух последних случаях сообщение ушло в dead_letters).
+        """
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put(OutboundMessage(chat_id, text, kind, kwargs, done))
+        return done
+
+    def try_submit(
+        self, chat_id: int, text: str, kind: str = "message", **kwargs
+    ) -> asyncio.Future | None:
+        """
+        Поставить сообщение в очередь без ожидания, как submit.
+        Возвращает None, если очередь заполнена.
+        """
+        done = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait(OutboundMessage(chat_id, text, kind, kwargs, done))
+        except asyncio.QueueFull:
+            return None
+        return done
+
+    async def _wait_for_chat(self, chat_id: int) -> None:
+        now = time.monotonic()
+        ready_at = self._chat_ready_at.get(chat_id, now)
+        self._chat_ready_at[chat_id] = max(ready_at, now) + self.chat_interval
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+
+        # Чаты, в которые давно ничего не отправлялось, больше не нужны
+        if len(self._chat_ready_at) > 10 * self._queue.maxsize:
+            self._chat_ready_at = {
+                chat: ready
+                for chat, ready in self._chat_ready_at.items()
+                if ready > now
+            }
+
+    async def _work(self) -> None:
+        while True:
+            message = await self._queue.get()
+            self._in_flight.add(message)
+            try:
+                await self._deliver(message)
+            except Exception as e:
+                logger.error(f"Ошибка отправителя для чата {message.chat_id}: {e}")
+                await self._dead_letter(message, str(e))
+            finally:
+                self._in_flight.discard(message)
+                self._queue.task_done()
+
+    async def _deliver(self, message: OutboundMessage) -> None:
+        await self._wait_for_chat(message.chat_id)
+        await self.bucket.acquire()
+
+        message.attempts += 1
+        try:
+            await self.bot.send_message(message.chat_id, message.text, **message.kwargs)
+        except TelegramRetryAfter as e:
+            # Лимит превышен: пауза для всех отправителей, попытка не считается
+            self.throttled += 1
+            message.attempts -= 1
+            self.bucket.pause(e.retry_after)
+            logger.warning(f"Telegram просит подождать {e.retry_after} с")
+            self._retry(message, 0)
+            return
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован, чат не найден или сообщение некорректно —
+            # повторять бесполезно
+            rejected = isinstance(e, TelegramForbiddenError) or any(
+                error in e.message.lower() for error in self.REJECTED_ERRORS
+            )
+            await self._dead_letter(
+                message, str(e), self.REJECTED if rejected else self.FAILED
+            )
+            return
+        except Exception as e:
+            if message.attempts >= self.max_attempts:
+                await self._dead_letter(message, str(e))
+                return
+            self.retried += 1
+            self._retry(message, 2 ** (message.attempts - 1))
+            return
+
+        self.sent += 1
+        self._sent_at.append(time.monotonic())
+        self._trim_sent()
+        if not message.done.done():
+            message.done.set_result(self.DELIVERED)
+
+    def _retry(self, message: OutboundMessage, delay: float) -> None:
+        async def requeue():
+            await asyncio.sleep(delay)
+            await self._queue.put(message)
+
+        task = asyncio.create_task(requeue())
+        self._retries[task] = message
+        task.add_done_callback(lambda task: self._retries.pop(task, None))
+
+    async def _dead_letter(
+        self, message: OutboundMessage, error: str, result: str = FAILED
+    ) -> None:
+        self.dead += 1
+        logger.warning(
+            f"Сообщение ({message.kind}) для чата {message.chat_id} не доставлено: {error}"
+        )
+        if not message.done.done():
+            message.done.set_result(result)
+        try:
+            await adb.add_dead_letter(
+                message.chat_id, message.kind, message.text, error, message.attempts
+            )
+        except Exception as e:
+            logger.error(f"Не удалось сохранить недоставленное сообщение: {e}")
+
+    async def _drain(self) -> None:
+        """Дождаться отправки очереди вместе с повторами, которые в неё вернутся."""
+        while True:
+            await self._queue.join()
+            if not self._retries:
+                return
+            await asyncio.wait(list(self._retries))
+
+    async def close(self, timeout: float = 30.0) -> None:
+        """
+        Дождаться отправки очереди и повторов (не дольше timeout) и остановить
+        отправителей. Неотправленные сообщения пишутся в dead_letters,
+        а их future завершаются с FAILED.
+        """
+        if self._workers:
+            try:
+                await asyncio.wait_for(self._drain(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        # Повтор, только что вернувшийся в очередь, может оказаться в обоих местах
+        unsent = self._in_flight | set(self._retries.values())
+        while not self._queue.empty():
+            unsent.add(self._queue.get_nowait())
+            self._queue.task_done()
+
+        tasks = [*self._workers, *self._retries]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._retries.clear()
+        self._in_flight.clear()
+
+        if unsent:
+            logger.warning(f"Не отправлено сообщений при остановке: {len(unsent)}")
+        for message in unsent:
+            await self._dead_letter(message, "бот остановлен до отправки")
+
+    def _trim_sent(self) -> None:
+        """Оставить отметки отправки только за последнее окно RATE_WINDOW."""
+        expired = time.monotonic() - self.RATE_WINDOW
+        while self._sent_at and self._sent_at[0] < expired:
+            self._sent_at.popleft()
+
+    def metrics(self) -> dict:
+        self._trim_sent()
+        return {
+            "queued": self._queue.qsize(),
+            "rate": len(self._sent_at) / self.RATE_WINDOW,
+            "sent": self.sent,
+            "retried": self.retried,
+            "throttled": self.throttled,
+            "dead": self.dead,
+        }
+
+
+outbound = OutboundEngine(
+    rate=settings.OUTBOUND_RATE,
+    burst=settings.OUTBOUND_BURST,
+    chat_interval=settings.OUTBOUND_CHAT_INTERVAL,
+    senders=settings.OUTBOUND_SENDERS,
+    max_attempts=settings.OUTBOUND_MAX_ATTEMPTS,
+    queue_size=settings.OUTBOUND_QUEUE_SIZE,
+)
@@ -1,90 +1,323 @@
+import asyncio
+import json
 import logging
-from datetime import datetime, timedelta
+import time
+from datetime import date, datetime, timedelta
 
-from aiogram.types import Message
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
-from database import db
-from helpers import WORKOUT_REMINDER_MESSAGE
+from config import settings
+from database import adb, db
+from helpers import SURVEY_MESSAGE, WORKOUT_REMINDER_MESSAGE
+from jobstore import DatabaseThreadScheduler, SQLiteJobStore
+from lease import leader_lease
+from outbound import outbound
+from storage import storage
 
-scheduler = AsyncIOScheduler()
+jobstore = SQLiteJobStore(db)
+scheduler = DatabaseThreadScheduler(adb, jobstores={"default": jobstore})
 
 logger = logging.getLogger(__name__)
 
 
-async def start_scheduler(bot):
-    # подгрузка включенных уведомок
-    reminders = db.get_all_on_reminders()
+class ReminderDispatcher:
+    """
+    Рассылка ежедневных напоминаний одной задачей планировщика.
+    Раз в минуту выбирает из БД пользователей, у которых напоминание
+    на эту минуту (по индексу remind_time), и пачками ставит сообщения
+    в очередь исходящих; скорость отправки ограничивает outbound.
+
+    Постановка в очередь не ждёт: когда очередь исходящих заполнена,
+    запуск заканчивается, а следующий продолжает с того же пользователя.
+    Положение рассылки (последняя разосланная минута и последний
+    поставленный в очередь пользователь следующей) хранится в БД рядом
+    с арендой лидера, так что его подхватывает и перезапущенный процесс,
+    и новый лидер. Минуты, пропущенные из-за долгой рассылки, досылаются
+    все; только если рассылку никто не вёл дольше catchup_minutes (бот был
+    выключен), досылаются лишь последние catchup_minutes минут.
+    Перед каждой пачкой проверяется, что процесс всё ещё лидер.
+    """
+
+    def __init__(self, batch_size: int, catchup_minutes: int):
+        self.batch_size = batch_size
+        self.catchup_minutes = catchup_minutes
+        self._last_minute: datetime | None = None
+        # Последний пользователь следующей минуты, уже поставленный в очередь
+        self._after_user_id = 0
+
+        self.dispatched = 0
+        self.skipped_minutes = 0
+        self.deferred = 0
+
+    def reset(self) -> None:
+        """Забыть положение рассылки: следующий запуск прочитает его из БД."""
+        self._last_minute = None
+        self._after_user_id = 0
+
+    async def _load_progress(self, now: datetime) -> None:
+        raw = await leader_lease.load_progress()
+        if raw is None:
+            self._last_minute = now - timedelta(minutes=1)
+            self._after_user_id = 0
+            return
+
+        progress = json.loads(raw)
+        self._last_minute = datetime.fromisoformat(progress["minute"])
+        self._after_user_id = progress.get("after_user_id", 0)
+        oldest = now - timedelta(minutes=self.catchup_minutes)
+        idle = time.time() - progress["saved_at"]
+        if self._last_minute < oldest and idle > self.catchup_minutes * 60:
+            skipped = int((oldest - self._last_minute).total_seconds() // 60)
+            self.skipped_minutes += skipped
+            logger.warning(
+                f"Рассылка напоминаний не велась {idle / 60:.0f} мин, "
+                f"пропущено минут: {skipped}"
+            )
+            self._last_minute = oldest
+            self._after_user_id = 0
+
+    async def _save_progress(self) -> bool:
+        """Сохранить положение рассылки; False, если процесс уже не лидер."""
+        progress = {
+            "minute": self._last_minute.isoformat(),
+            "after_user_id": self._after_user_id,
+            "saved_at": time.time(),
+        }
+        if await leader_lease.save_progress(json.dumps(progress)):
+            return True
+        # Рассылку продолжает новый лидер со своего положения; если лидерство
+        # вернётся, положение будет прочитано из БД заново
+        logger.warning("Положение рассылки напоминаний не сохранено: не лидер")
+        self.reset()
+        return False
+
+    async def dispatch(self) -> None:
+        now = datetime.now().replace(second=0, microsecond=0)
+        if self._last_minute is None:
+            await self._load_progress(now)
+
+        minute = self._last_minute + timedelta(minutes=1)
+        while minute <= now:
+            if not await self._dispatch_minute(minute.strftime("%H:%M")):
+                break
+            self._last_minute = minute
+            self._after_user_id = 0
+            if not await self._save_progress():
+                break
+            minute += timedelta(minutes=1)
+
+    async def _dispatch_minute(self, remind_time: str) -> bool:
+        """
+        Поставить в очередь напоминания на минуту, начиная после _after_user_id.
+        False, если минута не закончена: очередь заполнена или процесс
+        перестал быть лидером.
+        """
+        sent = 0
+        complete = False
+        while True:
+            if not await leader_lease.holds():
+                logger.warning(
+                    f"Рассылка напоминаний на {remind_time} прервана: не лидер"
+                )
+                break
+            user_ids = await adb.get_due_reminders(
+                remind_time, self._after_user_id, self.batch_size
+            )
+            if not user_ids:
+                complete = True
+                break
+
+            queued = 0
+            for user_id in user_ids:
+                if (
+                    outbound.try_submit(
+                        user_id, WORKOUT_REMINDER_MESSAGE, kind="reminder"
+                    )
+                    is None
+                ):
+                    break
+                self._after_user_id = user_id
+                queued += 1
+            sent += queued
+            if not await self._save_progress():
+                break
+            if queued < len(user_ids):
+                self.deferred += 1
+                logger.info(
+                    f"Очередь исходящих заполнена, напоминания на {remind_time} "
+                    f"продолжатся со следующим запуском"
+                )
+                break
+
+        self.dispatched += sent
+        if sent:
+            logger.info(f"Напоминания на {remind_time}: в очереди {sent}")
+        return complete
+
+
+reminder_dispatcher = ReminderDispatcher(
+    batch_size=settings.REMINDER_BATCH_SIZE,
+    catchup_minutes=settings.REMINDER_CATCHUP_MINUTES,
+)
+
+
+class SurveySweeper:
+    """
+    Рассылка анкет одной задачей планировщика, раз в день в SURVEY_TIME.
+    Выбирает пользователей, у которых подошёл срок анкеты (по индексу
+    survey_sent, survey_due_at), пачками по batch_size: пачка ставится
+    в очередь исходящих, и после доставки все получившие отмечаются
+    одним UPDATE. Пользователи, которые заблокировали бота или удалили чат,
+    отмечаются так же, чтобы им не пытаться отправить анкету каждый день;
+    кому не удалось доставить по другой причине, получат анкету в следующий раз.
+    Перед каждой пачкой проверяется, что процесс всё ещё лидер.
+    """
 
-    if not reminders:
-        logger.info("Нет активных напоминаний для восстановления.")
-        return
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
 
-    for job_id, user_id, remind_time in reminders:
-        hours, minutes = map(int, remind_time.split(":"))
+        self.delivered = 0
+        self.rejected = 0
+        self.failed = 0
 
-        scheduler.add_job(
-            send_reminder,
+    async def sweep(self) -> None:
+        due_date = date.today().isoformat()
+        after = ("", 0)
+        delivered = rejected = failed = 0
+        while True:
+            if not await leader_lease.holds():
+                logger.warning("Рассылка анкет прервана: не лидер")
+                break
+            rows = await adb.get_due_surveys(due_date, after, self.batch_size)
+            if not rows:
+                break
+            after = rows[-1]
+
+            user_ids = [user_id for _, user_id in rows]
+            deliveries = []
+            for user_id in user_ids:
+                deliveries.append(
+                    await outbound.submit(
+                        user_id, SURVEY_MESSAGE, kind="survey", parse_mode="Markdown"
+                    )
+                )
+            results = await asyncio.gather(*deliveries)
+            done_ids = [
+                user_id
+                for user_id, result in zip(user_ids, results)
+                if result in (outbound.DELIVERED, outbound.REJECTED)
+            ]
+            if done_ids:
+                await adb.mark_surveys_sent(done_ids)
+            batch_rejected = results.count(outbound.REJECTED)
+            delivered += len(done_ids) - batch_rejected
+            rejected += batch_rejected
+            failed += len(user_ids) - len(done_ids)
+
+        self.delivered += delivered
+        self.rejected += rejected
+        self.failed += failed
+        if delivered or rejected or failed:
+            logger.info(
+                f"Анкеты: доставлено {delivered}, получатель недоступен {rejected}, "
+                f"не доставлено {failed}"
+            )
+
+
+survey_sweeper = SurveySweeper(batch_size=settings.SURVEY_BATCH_SIZE)
+
+
+async def sweep_fsm_sessions():
+    await storage.sweep()
+
+
+async def dispatch_reminders():
+    await reminder_dispatcher.dispatch()
+
+
+async def sweep_surveys():
+    await survey_sweeper.sweep()
+
+
+def scheduled_jobs() -> list[tuple]:
+    """Задачи планировщика: (id, функция, триггер, параметры)."""
+    hours, minutes = map(int, settings.SURVEY_TIME.split(":"))
+    return [
+        # очистка неактивных сессий FSM
+        (
+            "fsm_sweeper",
+            sweep_fsm_sessions,
+            IntervalTrigger(seconds=settings.FSM_SWEEP_INTERVAL),
+            {},
+        ),
+        # напоминания: одна задача на все, в начале каждой минуты
+        (
+            "reminder_dispatcher",
+            dispatch_reminders,
+            CronTrigger(second=0),
+            {"coalesce": True, "max_instances": 1, "misfire_grace_time": 30},
+        ),
+        # анкеты: одна задача на всех, раз в день
+        (
+            "survey_sweeper",
+            sweep_surveys,
             CronTrigger(hour=hours, minute=minutes),
-            args=[None, bot, user_id],
-            id=job_id,
-        )
-
-    # Добавляем задания на отправку анкет через 2 дня после регистрации
-    users_with_survey = db.get_users_for_survey()
-    for user_id, registration_date in users_with_survey:
-        # Преобразуем строку даты в объект datetime
-        registration_datetime = datetime.fromisoformat(registration_date)
-        survey_date = registration_datetime + timedelta(days=2)
-
-        # Устанавливаем время на 19:40
-        survey_date = survey_date.replace(hour=19, minute=40)
-
-        logger.info(survey_date)
-        scheduler.add_job(
-            send_survey_notification,
-            CronTrigger(
-                year=survey_date.year,
-                month=survey_date.month,
-                day=survey_date.day,
-                hour=survey_date.hour,
-                minute=survey_date.minute,
-            ),
-            args=[bot, user_id],
-            id=f"survey_{user_id}",
-        )
-
-    logger.info(f"Восстановлено {len(reminders)} активных напоминаний.")
+            {
+                "coalesce": True,
+                "max_instances": 1,
+                # Если бот был выключен в это время, рассылка пройдёт после
+                # запуска, но не позже чем через 2 часа
+                "misfire_grace_time": 2 * 3600,
+            },
+        ),
+    ]
 
-    if not scheduler.running:
-        scheduler.start()
 
+def ensure_jobs() -> None:
+    """
+    Добавить задачи, которых ещё нет в хранилище. Уже сохранённые задачи
+    не пересоздаются, чтобы не потерять их время следующего запуска
+    (иначе пропущенный при выключенном боте запуск не будет выполнен);
+    меняются только параметры и, если расписание изменилось, триггер.
+    Вызывается в потоке БД.
+    """
+    with db.transaction():
+        for job_id, func, trigger, options in scheduled_jobs():
+            job = jobstore.lookup_job(job_id)
+            if job is None:
+                scheduler.add_job(func, trigger, id=job_id, **options)
+                continue
+            if options:
+                scheduler.modify_job(job_id, **options)
+            if str(job.trigger) != str(trigger):
+                scheduler.reschedule_job(job_id, trigger=trigger)
 
-async def send_reminder(message: Message | None, bot=None, chat_id: int = None):
-    try:
-        if bot:
-            await bot.send_message(chat_id, WORKOUT_REMINDER_MESSAGE)
-        else:
-            await message.answer(WORKOUT_REMINDER_MESSAGE)
-    except Exception as e:
-        logger.error(f"Ошибка при отправке напоминания: {e}")
+
+async def start_scheduler():
+    if not scheduler.running:
+        # Запуск на паузе не обращается к хранилищу задач
+        scheduler.start(paused=True)
+    await adb.run(ensure_jobs)
+    scheduler.resume()
 
 
-async def send_survey_notification(bot, user_id: int):
+async def on_leadership_acquired():
     """
-    Отправляет пользователю уведомление с просьбой заполнить анкету.
+    Лидер запускает планировщик; хранилище задач общее для всех процессов.
+    Рассылка напоминаний продолжится с положения, которое прежний лидер
+    сохранил рядом с арендой, так что минуты между его последним и нашим
+    первым запуском не теряются.
     """
-    try:
-        await bot.send_message(
-            user_id,
-            "Привет! Пожалуйста, уделите минуту, чтобы заполнить анкету о нашем боте: [Заполнить анкету](https://example.com/survey)",
-            parse_mode="Markdown",
-        )
-        db.mark_survey_sent(user_id)  # Отмечаем в базе данных
-
-        logger.info(f"Уведомление об анкете отправлено пользователю {user_id}")
-    except Exception as e:
-        logger.error(
-            f"Ошибка при отправке уведомления об анкете пользователю {user_id}: {e}"
-        )
+    # Положение в памяти могло устареть, пока рассылал другой процесс
+    reminder_dispatcher.reset()
+    if scheduler.running:
+        scheduler.resume()
+    else:
+        await start_scheduler()
+    logger.info("Рассылки запущены в этом процессе")
+
+
+async def on_leadership_lost():
+    scheduler.pause()
+    logger.info("Рассылки остановлены в этом процессе")
@@ -3,3 +3,5 @@ from aiogram.fsm.state import State, StatesGroup
 
 class TasksState(StatesGroup):
     question = State()
+    # Сессия с вопросом истекла: осталась только категория и уровень
+    expired = State()
@@ -0,0 +1,346 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (
+    BaseStorage,
+    DefaultKeyBuilder,
+    KeyBuilder,
+    StateType,
+    StorageKey,
+)
+
+from config import settings
+from database import AsyncDatabaseManager, adb
+from states.tasks import TasksState
+
+logger = logging.getLogger(__name__)
+
+
+def dump_data(data: dict[str, Any]) -> str:
+    """Компактный JSON для данных FSM."""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_storage, которое переживает перезапуск бота
+    и общее для нескольких процессов. Изменения попадают в LRU-кэш в памяти
+    и в БД: изменения, сделанные за flush_interval секунд, записываются одной
+    транзакцией, и set_state/set_data возвращаются только после неё. Поэтому
+    следующее обновление пользователя, в каком бы процессе оно ни обрабатывалось,
+    видит уже записанные task и correct_answer.
+
+    У каждой записи в БД есть версия, которая меняется при любой записи.
+    Если с БД работают несколько процессов (shared), попадание в кэш
+    проверяется по ней, так что изменения и очистка сессий другими процессами
+    не теряются; устаревшая запись перечитывается из БД. В одном процессе
+    кэш — единственный источник изменений, и попадание обходится без запроса к БД.
+
+    Кэш ограничен и числом записей, и объёмом в байтах. Сессии, которые
+    не менялись дольше своего времени жизни (ttl по состоянию или группе
+    состояний), удаляет sweep(); состояния из tombstones вместо удаления
+    заменяются «надгробием» с частью данных, чтобы вернувшемуся пользователю
+    можно было ответить осмысленно.
+    """
+
+    def __init__(
+        self,
+        db: AsyncDatabaseManager,
+        cache_size: int,
+        flush_interval: float,
+        max_bytes: int,
+        ttl: dict[str, float],
+        default_ttl: float,
+        shared: bool = True,
+        tombstones: dict[str, tuple[str, tuple[str, ...]]] | None = None,
+        key_builder: KeyBuilder | None = None,
+        sweep_batch: int = 500,
+    ):
+        self.db = db
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.default_ttl = default_ttl
+        self.shared = shared
+        self.tombstones = tombstones or {}
+        self.sweep_batch = sweep_batch
+        self.key_builder = key_builder or DefaultKeyBuilder(
+            with_bot_id=True, with_destiny=True
+        )
+
+        # key -> (состояние, данные, примерный размер в байтах, версия в БД)
+        self._cache: OrderedDict[str, tuple[str | None, dict, int, int | None]] = (
+            OrderedDict()
+        )
+        self._cache_bytes = 0
+        self._pending_states: dict[str, str | None] = {}
+        self._pending_data: dict[str, str] = {}
+        # Изменения, которые сейчас записываются в БД
+        self._flushing: tuple[dict, dict] = ({}, {})
+        self._flusher: asyncio.Task | None = None
+        # Завершится, когда накопленные изменения будут записаны
+        self._batch: asyncio.Future | None = None
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.flushes = 0
+        self.evicted = 0
+        self.expired = 0
+        self.sessions = 0
+
+    def _remember(
+        self,
+        key: str,
+        state: str | None,
+        data: dict,
+        size: int,
+        version: int | None,
+    ) -> None:
+        if self.cache_size <= 0:
+            return
+        self._forget(key)
+        size += len(key) + len(state or "")
+        self._cache[key] = (state, data, size, version)
+        self._cache_bytes += size
+        while len(self._cache) > self.cache_size or (
+            self._cache_bytes > self.max_bytes and len(self._cache) > 1
+        ):
+            _, (_, _, evicted_size, _) = self._cache.popitem(last=False)
+            self._cache_bytes -= evicted_size
+            self.evicted += 1
+
+    def _forget(self, key: str) -> None:
+        record = self._cache.pop(key, None)
+        if record is not None:
+            self._cache_bytes -= record[2]
+
+    def _has_pending(self, key: str) -> bool:
+        return any(
+            key in changes
+            for changes in (
+                self._pending_states,
+                self._pending_data,
+                *self._flushing,
+            )
+        )
+
+    async def _get(self, key: str) -> tuple[str | None, dict]:
+        record = self._cache.get(key)
+        if record is not None:
+            # Свои незаписанные изменения новее БД, иначе сверяем версию
+            fresh = (
+                not self.shared
+                or self._has_pending(key)
+                or await self.db.get_fsm_version(key) == record[3]
+            )
+            # Пока шёл запрос, запись могли изменить или вытеснить
+            record = self._cache.get(key)
+            if fresh and record is not None:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return record[0], record[1]
+            self.stale += 1
+
+        self.misses += 1
+        row = await self.db.get_fsm_record(key)
+        state, raw, version = row if row else (None, "{}", None)
+
+        # Ещё не записанные изменения новее того, что лежит в БД
+        pending = (self._pending_states, self._pending_data)
+        for states, datas in (self._flushing, pending):
+            if key in states:
+                state = states[key]
+            if key in datas:
+                raw = datas[key]
+
+        data = json.loads(raw)
+        self._remember(key, state, data, len(raw), version)
+        return state, data
+
+    async def _write(self) -> None:
+        """Дождаться записи в БД пакета, в который попали изменения."""
+        if self._batch is None:
+            self._batch = asyncio.get_running_loop().create_future()
+            self._flusher = asyncio.create_task(self._flush_later())
+        # Отмена ожидающего обработчика не отменяет запись остальных
+        await asyncio.shield(self._batch)
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Ошибка записи состояний FSM: {e}")
+
+    async def flush(self) -> None:
+        """Записать накопленные изменения в БД одной транзакцией."""
+        batch, self._batch = self._batch, None
+        states, data = self._pending_states, self._pending_data
+        self._pending_states, self._pending_data = {}, {}
+        try:
+            if states or data:
+                self._flushing = (states, data)
+                try:
+                    versions = await self.db.save_fsm_records(states, data)
+                finally:
+                    self._flushing = ({}, {})
+                self._set_versions(versions)
+                self.flushes += 1
+        except Exception as e:
+            # Изменения не записаны: обработчики получат ошибку, а кэш
+            # не должен отдавать то, чего нет в БД
+            for key in states.keys() | data.keys():
+                self._forget(key)
+            if batch is not None:
+                batch.set_exception(e)
+                # Ошибку уже получили ожидающие или записали в лог
+                batch.exception()
+            raise
+
+        if batch is not None:
+            batch.set_result(None)
+
+    def _set_versions(self, versions: dict[str, int | None]) -> None:
+        for key, version in versions.items():
+            record = self._cache.get(key)
+            if record is None:
+                continue
+            if self._has_pending(key):
+                # В кэше уже следующие изменения: версия станет известна
+                # после их записи, а до тех пор запись не сверяется с БД
+                continue
+            self._cache[key] = (*record[:3], version)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        state = state.state if isinstance(state, State) else state
+
+        record = self._cache.get(storage_key)
+        if record is not None:
+            size = record[2] - len(storage_key) - len(record[0] or "")
+            self._remember(storage_key, state, record[1], size, record[3])
+        self._pending_states[storage_key] = state
+        await self._write()
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._get(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        if not isinstance(data, dict):
+            raise ValueError(f"Data must be a dict, not {type(data).__name__}")
+
+        raw = dump_data(data)
+        record = self._cache.get(storage_key)
+        if record is not None:
+            self._remember(storage_key, record[0], data.copy(), len(raw), record[3])
+        self._pending_data[storage_key] = raw
+        await self._write()
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._get(self.key_builder.build(key))
+        return data.copy()
+
+    async def close(self) -> None:
+        """Записать всё, что осталось."""
+        await self.flush()
+        if self._flusher is not None:
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        self._flusher = None
+
+    def _ttl(self, state: str | None) -> float:
+        if state is None:
+            return self.default_ttl
+        if state in self.ttl:
+            return self.ttl[state]
+        return self.ttl.get(state.split(":", 1)[0], self.default_ttl)
+
+    async def sweep(self) -> int:
+        """
+        Удалить сессии, которые не менялись дольше своего времени жизни.
+        Возвращает число удалённых и заменённых надгробием сессий.
+        """
+        await self.flush()
+        now = time.time()
+        cutoff = now - min([self.default_ttl, *self.ttl.values()])
+        after = (0.0, "")
+        expired = 0
+
+        while True:
+            rows = await self.db.get_idle_fsm_records(cutoff, after, self.sweep_batch)
+            if not rows:
+                break
+            after = (rows[-1][3], rows[-1][0])
+
+            replaced, deleted = [], []
+            for key, state, raw, updated_at in rows:
+                if updated_at >= now - self._ttl(state):
+                    continue
+                # Пользователь как раз что-то делает — изменения ещё не записаны
+                if self._has_pending(key):
+                    continue
+
+                if state in self.tombstones:
+                    tombstone, kept = self.tombstones[state]
+                    data = json.loads(raw)
+                    kept_data = {name: data[name] for name in kept if name in data}
+                    replaced.append((tombstone, dump_data(kept_data), key, updated_at))
+                else:
+                    deleted.append((key, updated_at))
+
+            if replaced or deleted:
+                await self.db.expire_fsm_records(replaced, deleted)
+                for _, _, key, _ in replaced:
+                    self._forget(key)
+                for key, _ in deleted:
+                    self._forget(key)
+                expired += len(replaced) + len(deleted)
+
+        self.expired += expired
+        self.sessions = await self.db.count_fsm_sessions()
+        if expired:
+            logger.info(
+                f"Очистка FSM: истекло сессий {expired}, активных {self.sessions}"
+            )
+        return expired
+
+    def memory_bytes(self) -> int:
+        """Примерный объём данных FSM в памяти процесса."""
+        pending = sum(len(raw) for raw in self._pending_data.values())
+        return self._cache_bytes + pending
+
+    def metrics(self) -> dict:
+        return {
+            "sessions": self.sessions,
+            "bytes": self.memory_bytes(),
+            "cached": len(self._cache),
+            "pending": len(self._pending_states) + len(self._pending_data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "flushes": self.flushes,
+        }
+
+
+storage = SQLiteStorage(
+    adb,
+    cache_size=settings.FSM_CACHE_SIZE,
+    flush_interval=settings.FSM_FLUSH_INTERVAL,
+    max_bytes=settings.FSM_CACHE_MAX_BYTES,
+    ttl=settings.FSM_SESSION_TTL,
+    default_ttl=settings.FSM_SESSION_TTL_DEFAULT,
+    shared=settings.FSM_SHARED,
+    tombstones={
+        TasksState.question.state: (TasksState.expired.state, ("category", "level"))
+    },
+)
@@ -0,0 +1,92 @@
+import random
+
+# Похожие друг на друга символы, среди которых легко пропустить нужный
+SYMBOL_SETS = [
+    "ОСQ0",
+    "ЕЁЭЗ",
+    "ШЩЦЧ",
+    "bdpq",
+    "1lI7",
+    "6890",
+]
+
+
+def generate_symbol_task(level: int):
+    """Таблица символов, в которой нужно посчитать вхождения заданного символа."""
+    size = min(4 + level // 2, 12)
+    alphabet = random.choice(SYMBOL_SETS[: min(2 + level // 3, len(SYMBOL_SETS))])
+    target = random.choice(alphabet)
+
+    grid = [[random.choice(alphabet) for _ in range(size)] for _ in range(size)]
+    count = sum(row.count(target) for row in grid)
+
+    table = "\n".join(" ".join(row) for row in grid)
+    task = f"Сколько раз символ «{target}» встречается в таблице?\n\n{table}"
+    points = 1 + size * size // 8
+    return "Поиск символов", task, str(count), points
+
+
+def _arithmetic(level: int, length: int) -> list[int]:
+    start = random.randint(1, 10 * level)
+    step = random.choice([-1, 1]) * random.randint(2, 3 + 2 * level)
+    return [start + step * i for i in range(length)]
+
+
+def _geometric(level: int, length: int) -> list[int]:
+    start = random.randint(1, 3 + level)
+    ratio = random.randint(2, 2 + level // 4)
+    return [start * ratio**i for i in range(length)]
+
+
+def _fibonacci(level: int, length: int) -> list[int]:
+    sequence = [random.randint(1, 2 + level), random.randint(1, 2 + level)]
+    while len(sequence) < length:
+        sequence.append(sequence[-1] + sequence[-2])
+    return sequence
+
+
+def _interleaved(level: int, length: int) -> list[int]:
+    first = _arithmetic(level, (length + 1) // 2)
+    second = _arithmetic(level, length // 2)
+    return [first[i // 2] if i % 2 == 0 else second[i // 2] for i in range(length)]
+
+
+# Виды последовательностей: (минимальный уровень, генератор, базовые баллы)
+SEQUENCE_KINDS = [
+    (1, _arithmetic, 2),
+    (3, _geometric, 3),
+    (5, _fibonacci, 4),
+    (7, _interleaved, 5),
+]
+
+
+def generate_sequence_task(level: int):
+    """Числовая последовательность, для которой нужно найти следующий элемент."""
+    kinds = [kind for kind in SEQUENCE_KINDS if kind[0] <= level]
+    _, generator, base_points = random.choice(kinds)
+
+    length = 5 + min(level // 4, 3)
+    sequence = generator(level, length + 1)
+    shown, answer = sequence[:-1], sequence[-1]
+
+    task = (
+        "Определите следующий элемент последовательности:\n"
+        f"{', '.join(map(str, shown))}, ?"
+    )
+    points = base_points + level // 2
+    return "Распознавание последовательностей", task, str(answer), points
+
+
+# Категории, для которых есть локальные генераторы
+LOCAL_GENERATORS = {
+    "Поиск символов": generate_symbol_task,
+    "Распознавание последовательностей": generate_sequence_task,
+}
+
+
+def generate_task_locally(level: int, category: str):
+    """
+    Генерация задания без обращения к GigaChat.
+    Возвращает (категория, текст задания, правильный ответ, баллы).
+    """
+    return LOCAL_GENERATORS[category](max(level, 1))
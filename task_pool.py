@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from AI import generate_task, generate_tasks
+from config import settings
+from helpers import category_map
+
+logger = logging.getLogger(__name__)
+
+
+class TaskPool:
+    """
+    Буфер заранее сгенерированных заданий для каждой пары (категория, диапазон уровней).
+    Задания хранятся уже разобранными: (категория, текст, правильный ответ, баллы).
+    """
+
+    def __init__(
+        self, size: int, level_band: int, warm_bands: int, refill_concurrency: int
+    ):
+        self.size = size
+        self.level_band = level_band
+        self.warm_bands = warm_bands
+        self._buffers: dict[tuple[str, int], deque] = {}
+        self._refills: dict[tuple[str, int], asyncio.Task] = {}
+        self._refill_limit = asyncio.Semaphore(refill_concurrency)
+
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_errors = 0
+
+    def _band(self, level: int) -> int:
+        return max(level - 1, 0) // self.level_band
+
+    def _band_level(self, band: int) -> int:
+        """Уровень, для которого генерируются задания диапазона."""
+        return band * self.level_band + (self.level_band + 1) // 2
+
+    def _buffer(self, key: tuple[str, int]) -> deque:
+        if key not in self._buffers:
+            self._buffers[key] = deque(maxlen=self.size)
+        return self._buffers[key]
+
+    def get(self, category: str, level: int):
+        """Взять готовое задание из пула. Возвращает None, если пул пуст."""
+        key = (category, self._band(level))
+        buffer = self._buffer(key)
+
+        task = buffer.popleft() if buffer else None
+        if task is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        self.refill(category, level)
+        return task
+
+    def put(self, category: str, level: int, task: tuple) -> bool:
+        """Вернуть задание в пул. Возвращает False, если буфер уже заполнен."""
+        buffer = self._buffer((category, self._band(level)))
+        if len(buffer) >= self.size:
+            return False
+        buffer.append(task)
+        return True
+
+    def refill(self, category: str, level: int) -> None:
+        """Запустить фоновое пополнение буфера, если оно ещё не идёт."""
+        key = (category, self._band(level))
+        if len(self._buffer(key)) >= self.size:
+            return
+
+        running = self._refills.get(key)
+        if running is not None and not running.done():
+            return
+
+        self._refills[key] = asyncio.create_task(self._refill(key))
+
+    async def _refill(self, key: tuple[str, int]) -> None:
+        category, band = key
+        buffer = self._buffer(key)
+
+        while len(buffer) < self.size:
+            # Недостающие задания запрашиваются одним пакетным вызовом
+            async with self._refill_limit:
+                try:
+                    tasks = await generate_tasks(
+                        level=self._band_level(band),
+                        category=category,
+                        count=self.size - len(buffer),
+                    )
+                except Exception as e:
+                    self.refill_errors += 1
+                    logger.error(
+                        f"Ошибка пополнения пула заданий ({category}, диапазон {band}): {e}"
+                    )
+                    return
+
+            buffer.extend(tasks)
+            self.refills += len(tasks)
+
+    def start(self) -> None:
+        """Прогрев пула для всех категорий и первых диапазонов уровней."""
+        for category in category_map.values():
+            for band in range(self.warm_bands):
+                self.refill(category, self._band_level(band))
+
+    async def close(self) -> None:
+        for refill in self._refills.values():
+            refill.cancel()
+        await asyncio.gather(*self._refills.values(), return_exceptions=True)
+        self._refills.clear()
+
+    def metrics(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "refills": self.refills,
+            "refill_errors": self.refill_errors,
+            "buffered": sum(len(buffer) for buffer in self._buffers.values()),
+        }
+
+
+task_pool = TaskPool(
+    size=settings.TASK_POOL_SIZE,
+    level_band=settings.TASK_POOL_LEVEL_BAND,
+    warm_bands=settings.TASK_POOL_WARM_BANDS,
+    refill_concurrency=settings.TASK_POOL_REFILL_CONCURRENCY,
+)
+
+
+class QuestionPrefetcher:
+    """
+    Упреждающая генерация следующего задания для пользователя.
+    Пока пользователь отвечает, готовятся задания для обоих исходов:
+    уровень + 1 (верный ответ) и уровень - 1 (ошибка).
+    Задания пользователей, которые не ответили за ttl секунд, возвращаются
+    в пул; одновременно хранятся задания не больше чем для max_users.
+    """
+
+    def __init__(self, pool: TaskPool, ttl: float, max_users: int):
+        self.pool = pool
+        self.ttl = ttl
+        self.max_users = max_users
+        # user_id -> (категория, задания по уровням, время начала);
+        # порядок вставки совпадает с порядком start(), старые записи в начале
+        self._pending: dict[int, tuple[str, dict[int, asyncio.Task], float]] = {}
+
+        self.used = 0
+        self.recycled = 0
+        self.expired = 0
+
+    def start(self, user_id: int, category: str, level: int) -> None:
+        """Начать подготовку заданий для следующего хода пользователя."""
+        self.discard(user_id)
+        self._expire()
+        levels = {level + 1, max(level - 1, 1)}
+        self._pending[user_id] = (
+            category,
+            {lvl: asyncio.create_task(self._fetch(category, lvl)) for lvl in levels},
+            time.monotonic(),
+        )
+
+    def _expire(self) -> None:
+        """Вернуть в пул задания ушедших пользователей и соблюсти max_users."""
+        expired_at = time.monotonic() - self.ttl
+        while self._pending:
+            user_id, (_, _, started_at) = next(iter(self._pending.items()))
+            if started_at > expired_at and len(self._pending) < self.max_users:
+                break
+            self.discard(user_id)
+            self.expired += 1
+
+    async def _fetch(self, category: str, level: int):
+        task = self.pool.get(category, level)
+        if task is None:
+            task = await generate_task(level=level, category=category)
+        return task
+
+    async def take(self, user_id: int, category: str, level: int):
+        """
+        Забрать подготовленное задание для итогового уровня.
+        Задание для другого исхода возвращается в пул или отменяется.
+        """
+        pending = self._pending.pop(user_id, None)
+        if pending is None:
+            return None
+
+        prefetched_category, fetches, _ = pending
+        chosen = fetches.pop(level, None) if prefetched_category == category else None
+        self._recycle(prefetched_category, fetches)
+
+        if chosen is None:
+            return None
+
+        try:
+            task = await chosen
+        except Exception as e:
+            logger.warning(f"Упреждающая генерация для {user_id} не удалась: {e}")
+            return None
+
+        self.used += 1
+        return task
+
+    def discard(self, user_id: int) -> None:
+        """Сбросить подготовленные задания пользователя (выход из теста)."""
+        pending = self._pending.pop(user_id, None)
+        if pending is not None:
+            category, fetches, _ = pending
+            self._recycle(category, fetches)
+
+    def _recycle(self, category: str, fetches: dict[int, asyncio.Task]) -> None:
+        for level, fetch in fetches.items():
+            if not fetch.done():
+                fetch.cancel()
+            elif not fetch.cancelled() and fetch.exception() is None:
+                if self.pool.put(category, level, fetch.result()):
+                    self.recycled += 1
+
+    async def close(self) -> None:
+        fetches = [
+            fetch
+            for _, pending, _ in self._pending.values()
+            for fetch in pending.values()
+        ]
+        self._pending.clear()
+        for fetch in fetches:
+            fetch.cancel()
+        await asyncio.gather(*fetches, return_exceptions=True)
+
+    def metrics(self) -> dict:
+        return {
+            "users": len(self._pending),
+            "used": self.used,
+            "recycled": self.recycled,
+            "expired": self.expired,
+        }
+
+
+prefetcher = QuestionPrefetcher(
+    task_pool,
+    ttl=settings.PREFETCH_TTL,
+    max_users=settings.PREFETCH_MAX_USERS,
+)
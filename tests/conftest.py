@@ -0,0 +1,8 @@
+import os
+import sys
+
+# config читает обязательные настройки при импорте
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ.setdefault("GIGACHAT_API_KEY", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
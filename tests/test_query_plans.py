@@ -0,0 +1,17 @@
+import pytest
+
+from database import DatabaseManager
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager(str(tmp_path / "test.db"))
+    manager.create_tables()
+    manager.migrate()
+    yield manager
+    manager.close()
+
+
+def test_hot_queries_use_indexes(db):
+    """Частые запросы не просматривают таблицы целиком и не сортируют во временном B-дереве."""
+    assert db.check_query_plans() == {}
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import secrets
+from collections import deque
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import setup_application
+from aiohttp import web
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_chat_key(update: Update) -> int:
+    """Ключ очереди: id чата, а если его нет — пользователя или самого обновления."""
+    context = UserContextMiddleware.resolve_event_context(update)
+    if context.chat is not None:
+        return context.chat.id
+    if context.user is not None:
+        return context.user.id
+    return -update.update_id
+
+
+class ChatOrderedQueue:
+    """
+    Очередь обновлений с ограниченным числом одновременно обрабатываемых.
+    Обновления разных чатов обрабатываются параллельно (до concurrency штук),
+    обновления одного чата — строго по очереди, в порядке поступления.
+    Всего в очереди и в обработке не больше max_pending обновлений:
+    при переполнении put() ждёт освобождения места не дольше timeout.
+    """
+
+    def __init__(self, handler, concurrency: int, max_pending: int, timeout: float):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(max_pending)
+        self._chats: dict[int, deque] = {}
+        self._ready: asyncio.Queue[int] = asyncio.Queue()
+        self._workers: list[asyncio.Task] = []
+        self._pending = 0
+
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(self.concurrency)
+        ]
+
+    async def put(self, key: int, update: Update) -> bool:
+        """Поставить обновление в очередь. False — очередь переполнена."""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+
+        self._pending += 1
+        chat = self._chats.get(key)
+        if chat is not None:
+            # Чат уже в работе или ждёт обработчика — просто дописываем в конец
+            chat.append(update)
+        else:
+            self._chats[key] = deque([update])
+            self._ready.put_nowait(key)
+        return True
+
+    async def _work(self) -> None:
+        while True:
+            key = await self._ready.get()
+            chat = self._chats[key]
+            while chat:
+                update = chat[0]
+                try:
+                    await self.handler(update)
+                    self.processed += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+                finally:
+                    chat.popleft()
+                    self._pending -= 1
+                    self._slots.release()
+            del self._chats[key]
+
+    async def close(self, timeout: float) -> None:
+        """Дождаться обработки принятых обновлений и остановить обработчики."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._pending and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        if self._pending:
+            logger.warning(f"Не обработано обновлений при остановке: {self._pending}")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def metrics(self) -> dict:
+        return {
+            "pending": self._pending,
+            "chats": len(self._chats),
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+def create_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """
+    aiohttp-приложение, принимающее обновления Telegram по вебхуку.
+    Ответ 200 отправляется сразу после постановки в очередь; при переполнении
+    очереди возвращается 503, и Telegram повторит доставку позже.
+    Порядок внутри чата гарантируется в пределах одного экземпляра.
+    Обновления без верного секрета в заголовке отклоняются с кодом 401.
+    """
+    secret = settings.WEBHOOK_SECRET
+    if not secret:
+        raise RuntimeError("WEBHOOK_SECRET не задан: вебхук без секрета не запускается")
+
+    queue = ChatOrderedQueue(
+        handler=lambda update: dp.feed_update(bot, update),
+        concurrency=settings.WEBHOOK_CONCURRENCY,
+        max_pending=settings.WEBHOOK_MAX_PENDING,
+        timeout=settings.WEBHOOK_QUEUE_TIMEOUT,
+    )
+
+    async def handle(request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except Exception as e:
+            logger.warning(f"Некорректное обновление от {request.remote}: {e}")
+            return web.Response(status=400)
+
+        if not await queue.put(update_chat_key(update), update):
+            return web.Response(status=503)
+        return web.Response()
+
+    async def on_startup(app: web.Application) -> None:
+        queue.start()
+        if settings.WEBHOOK_URL:
+            await bot.set_webhook(
+                url=settings.WEBHOOK_URL,
+                secret_token=secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=min(settings.WEBHOOK_CONCURRENCY, 100),
+            )
+            logger.info(f"Вебхук установлен: {settings.WEBHOOK_URL}")
+
+    async def on_shutdown(app: web.Application) -> None:
+        await queue.close(timeout=settings.WEBHOOK_DRAIN_TIMEOUT)
+
+    app = web.Application()
+    app["update_queue"] = queue
+    app.router.add_post(settings.WEBHOOK_PATH, handle)
+    setup_application(app, dp, bot=bot)
+    # Приём начинается после хуков запуска диспетчера, а очередь
+    # останавливается раньше, чем хуки остановки закроют БД
+    app.on_startup.append(on_startup)
+    app.on_shutdown.insert(0, on_shutdown)
+    app.on_cleanup.append(lambda app: bot.session.close())
+    return app
+
+
+def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    web.run_app(
+        create_app(dp, bot),
+        host=settings.WEBHOOK_HOST,
+        port=settings.WEBHOOK_PORT,
+        print=None,
+    )